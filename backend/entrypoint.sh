@@ -6,8 +6,17 @@ python3 manage.py makemigrations web_site
 
 python3 manage.py migrate --no-input
 
+# рейтинг ?ordering=popular; дальше его обновляет refresh_popularity по расписанию
+python3 manage.py refresh_popularity
+
 python3 manage.py collectstatic --no-input
 
 #python3 manage.py filling_db
 
-gunicorn foodgram.wsgi:application --bind 0.0.0.0:8000
\ No newline at end of file
+# ASYNC_READ_VIEWS=True включает асинхронные GET-эндпоинты, им нужен ASGI
+if [ "$ASYNC_READ_VIEWS" = "True" ]; then
+    gunicorn foodgram.asgi:application --bind 0.0.0.0:8000 \
+        -k uvicorn.workers.UvicornWorker
+else
+    gunicorn foodgram.wsgi:application --bind 0.0.0.0:8000
+fi
\ No newline at end of file
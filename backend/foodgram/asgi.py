@@ -15,3 +15,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_asgi_application()
 
+# после настройки Django: таймаут запросов только для веб-сервера
+from foodgram.db import timeouts  # noqa: E402
+
+timeouts.enable()
+
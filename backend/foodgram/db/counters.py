@@ -0,0 +1,25 @@
+from django.db import transaction
+
+
+class CountersMixin:
+    """Сохранение в одной транзакции с сигналами, которые ведут счетчики.
+
+    Поля counter_fields меняет только web_site.counters через F(),
+    поэтому save() уже существующей строки их не перезаписывает.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (
+            self.counter_fields
+            and not self._state.adding
+            and not args
+            and kwargs.get("update_fields") is None
+        ):
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
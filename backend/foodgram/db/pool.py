@@ -0,0 +1,202 @@
+"""Пул соединений с бд, общий для потоков процесса.
+
+Django 4.2 умеет только держать по соединению на поток (CONN_MAX_AGE),
+а под ASGI запросы обслуживают разные потоки, и соединений становится
+столько же. Бэкенд foodgram.db.postgresql берет соединение из пула при
+первом запросе к бд и возвращает его, когда Django закрывает соединение
+в конце запроса (CONN_MAX_AGE = 0). Если свободных соединений нет и
+открыто уже size, запрос ждет не дольше timeout секунд.
+"""
+import threading
+import time
+from collections import deque
+
+from foodgram import metrics
+
+WAIT_BOUNDS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10)
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class Entry:
+    __slots__ = ("connection", "created", "returned")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = self.returned = time.monotonic()
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """Не больше size соединений; check проверяет соединение, простоявшее
+    дольше check_interval, reset готовит соединение к возврату в пул и
+    возвращает False, если его нужно закрыть"""
+
+    def __init__(self, name, check, reset, size=10, timeout=5,
+                 max_lifetime=1800, check_interval=30):
+        self.name = name
+        self.check = check
+        self.reset = reset
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        self.condition = threading.Condition()
+        # свободные соединения; последнее возвращенное - справа
+        self.idle = deque()
+        self.in_use = {}
+        self.opening = 0
+        self.checkouts = 0
+        self.exhausted = 0
+        self.failed_checks = 0
+        self.wait = metrics.new_series(WAIT_BOUNDS)
+
+    def expired(self, entry, now):
+        return now - entry.created >= self.max_lifetime
+
+    def reserve(self, deadline):
+        """Свободное соединение или None, если можно открыть новое"""
+        with self.condition:
+            while True:
+                while self.idle:
+                    entry = self.idle.pop()
+                    if not self.expired(entry, time.monotonic()):
+                        self.in_use[id(entry.connection)] = entry
+                        return entry
+                    close_quietly(entry.connection)
+                if len(self.in_use) + self.opening < self.size:
+                    self.opening += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.exhausted += 1
+                    raise PoolExhausted(
+                        f"Пул соединений {self.name}: все {self.size} "
+                        f"заняты дольше {self.timeout} с"
+                    )
+                self.condition.wait(remaining)
+
+    def checkout(self, connect):
+        """Соединение из пула; connect открывает новое"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            entry = self.reserve(deadline)
+            if entry is None:
+                try:
+                    connection = connect()
+                except BaseException:
+                    with self.condition:
+                        self.opening -= 1
+                        self.condition.notify()
+                    raise
+                with self.condition:
+                    self.opening -= 1
+                    self.in_use[id(connection)] = Entry(connection)
+                break
+            connection = entry.connection
+            stale = started - entry.returned >= self.check_interval
+            if connection.closed or (stale and not self.check(connection)):
+                self.discard(connection, failed_check=True)
+                continue
+            break
+        with self.condition:
+            self.checkouts += 1
+            metrics.observe(self.wait, WAIT_BOUNDS, time.monotonic() - started)
+        return connection
+
+    def discard(self, connection, failed_check=False):
+        close_quietly(connection)
+        with self.condition:
+            self.failed_checks += failed_check
+            self.in_use.pop(id(connection), None)
+            self.condition.notify()
+
+    def checkin(self, connection, broken=False):
+        with self.condition:
+            entry = self.in_use.get(id(connection))
+        if entry is None:
+            close_quietly(connection)
+            return
+        now = time.monotonic()
+        if (broken or connection.closed or self.expired(entry, now)
+                or not self.reset(connection)):
+            self.discard(connection)
+            return
+        entry.returned = now
+        with self.condition:
+            del self.in_use[id(connection)]
+            self.idle.append(entry)
+            self.condition.notify()
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": len(self.in_use),
+                "checkouts": self.checkouts,
+                "exhausted": self.exhausted,
+                "failed_checks": self.failed_checks,
+                "wait": {**self.wait, "buckets": list(self.wait["buckets"])},
+            }
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+# метрика, тип, описание
+POOL_METRICS = (
+    ("size", "gauge", "Максимум соединений в пуле"),
+    ("connections", "gauge", "Открытые соединения пула"),
+    ("checkouts_total", "counter", "Выдано соединений"),
+    ("exhausted_total", "counter", "Отказы по таймауту ожидания"),
+    ("failed_checks_total", "counter", "Соединения, закрытые после проверки"),
+    ("wait_seconds", "histogram", "Ожидание свободного соединения"),
+)
+
+
+def collect():
+    """Метрики всех пулов процесса в формате Prometheus"""
+    with pools_lock:
+        snapshots = [(pool.name, pool.snapshot()) for pool in pools.values()]
+    lines = []
+    for metric, kind, description in POOL_METRICS if snapshots else ():
+        name = f"foodgram_db_pool_{metric}"
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for pool, values in snapshots:
+            label = f'pool="{pool}"'
+            if metric == "connections":
+                for state in ("idle", "in_use"):
+                    lines.append(
+                        f'{name}{{{label},state="{state}"}} {values[state]}'
+                    )
+            elif metric == "wait_seconds":
+                lines.extend(metrics.histogram_lines(
+                    name, label, WAIT_BOUNDS, values["wait"]
+                ))
+            else:
+                value = values[metric.removesuffix("_total")]
+                lines.append(f"{name}{{{label}}} {value}")
+    return lines
+
+
+metrics.registry.collectors.append(collect)
+
+
+def get_pool(key, name, **options):
+    with pools_lock:
+        pool = pools.get(key)
+        if pool is None:
+            pool = pools[key] = ConnectionPool(name, **options)
+        return pool
@@ -0,0 +1,79 @@
+"""Бэкенд PostgreSQL с пулом соединений (foodgram.db.pool).
+
+Настройки пула - DATABASES[...]["OPTIONS"]["pool"]: size, timeout,
+max_lifetime, check_interval. CONN_MAX_AGE должен быть 0: Django
+"закрывает" соединение в конце запроса, и оно возвращается в пул.
+"""
+from functools import partial
+
+from django.db.backends.postgresql import base
+from django.utils.asyncio import async_unsafe
+
+from foodgram.db.pool import PoolExhausted, get_pool
+
+Database = base.Database
+# TRANSACTION_STATUS_IDLE у psycopg2 и TransactionStatus.IDLE у psycopg 3
+IDLE = 0
+
+
+def check(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        if connection.info.transaction_status != IDLE:
+            connection.rollback()
+    except Database.Error:
+        return False
+    return True
+
+
+def reset(connection):
+    """Откатывает незавершенную транзакцию перед возвратом в пул"""
+    try:
+        if connection.info.transaction_status != IDLE:
+            connection.rollback()
+    except Database.Error:
+        return False
+    return connection.info.transaction_status == IDLE
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    pool = None
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop("pool", None)
+        return conn_params
+
+    def get_pool(self, conn_params):
+        # _nodb_cursor и тестовая бд подключаются с другими параметрами,
+        # у них свои пулы
+        key = (self.alias, repr(sorted(conn_params.items())))
+        name = f"{self.alias}:{conn_params.get('dbname', '')}"
+        return get_pool(
+            key,
+            name,
+            check=check,
+            reset=reset,
+            **self.settings_dict["OPTIONS"].get("pool", {})
+        )
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        try:
+            return self.pool.checkout(
+                partial(super().get_new_connection, conn_params)
+            )
+        except PoolExhausted as exc:
+            raise Database.OperationalError(str(exc)) from exc
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                # после ошибок Django сам проверяет соединение и закрывает
+                # нерабочее; здесь errors_occurred значит, что проверки не было
+                self.pool.checkin(
+                    self.connection,
+                    broken=self.errors_occurred
+                )
@@ -0,0 +1,26 @@
+"""statement_timeout для соединений, которые обслуживают запросы.
+
+Ограничение нужно веб-запросам: медленный запрос не должен держать
+соединение и воркер. Миграции, пересчеты и заполнение бд идут через
+manage.py и работают столько, сколько нужно, поэтому таймаут включают
+только точки входа веб-сервера (wsgi.py, asgi.py): каждое соединение,
+которое они открывают или берут из пула, получает SET statement_timeout.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+def set_statement_timeout(sender, connection, **kwargs):
+    timeout = settings.DB_STATEMENT_TIMEOUT
+    if connection.vendor != "postgresql" or not timeout:
+        return
+    # SET не принимает параметры при серверной подстановке psycopg 3
+    with connection.cursor() as cursor:
+        cursor.execute(f"SET statement_timeout = {int(timeout)}")
+
+
+def enable():
+    connection_created.connect(
+        set_statement_timeout,
+        dispatch_uid="foodgram.db.timeouts"
+    )
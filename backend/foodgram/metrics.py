@@ -0,0 +1,205 @@
+"""Метрики запросов: время, SQL, сериализация и размер ответа.
+
+MetricsMiddleware (foodgram/middleware.py) заводит на каждый запрос
+RequestMetrics в contextvar. SQL-запросы считает обертка курсора,
+которая ставится на каждое соединение с бд, время сериализации -
+TimedSerializerMixin. Итог уходит в заголовок Server-Timing и в
+гистограммы по имени view (RecipeView.list, DownloadShoppingCartView.get),
+которые MetricsView (foodgram/views.py) отдает персоналу в текстовом
+формате Prometheus.
+Гистограммы живут в памяти процесса: при нескольких воркерах каждый
+отдает свои, Prometheus складывает их по меткам сам.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+current = ContextVar("request_metrics", default=None)
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# поле RequestMetrics: имя метрики, описание, границы корзин
+HISTOGRAMS = {
+    "total": (
+        "foodgram_request_duration_seconds",
+        "Полное время обработки запроса",
+        SECONDS
+    ),
+    "db": (
+        "foodgram_request_db_seconds",
+        "Время SQL-запросов за запрос",
+        SECONDS
+    ),
+    "queries": (
+        "foodgram_request_db_queries",
+        "Число SQL-запросов за запрос",
+        QUERIES
+    ),
+    "serializer": (
+        "foodgram_request_serializer_seconds",
+        "Время сериализации, включая SQL внутри нее",
+        SECONDS
+    ),
+    "size": (
+        "foodgram_response_size_bytes",
+        "Размер тела ответа после сжатия",
+        BYTES
+    ),
+}
+
+
+class RequestMetrics:
+    __slots__ = ("started", "view", "queries", "db", "serializer", "depth")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = "unresolved"
+        self.queries = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.depth = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        return (
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries", '
+            f"serializer;dur={self.serializer * 1000:.1f}, "
+            f"total;dur={total * 1000:.1f}"
+        )
+
+    def values(self, total, size):
+        return {
+            "total": total,
+            "db": self.db,
+            "queries": self.queries,
+            "serializer": self.serializer,
+            "size": size,
+        }
+
+
+def histogram_lines(name, label, bounds, series):
+    """Строки гистограммы в формате Prometheus; label - 'имя="значение"'"""
+    lines = []
+    cumulative = 0
+    for bound, count in zip((*bounds, "+Inf"), series["buckets"]):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{label}}} {series['sum']}")
+    lines.append(f"{name}_count{{{label}}} {series['count']}")
+    return lines
+
+
+def new_series(bounds):
+    return {"buckets": [0] * (len(bounds) + 1), "sum": 0, "count": 0}
+
+
+def observe(series, bounds, value):
+    series["buckets"][bisect_left(bounds, value)] += 1
+    series["sum"] += value
+    series["count"] += 1
+
+
+class Registry:
+    """Гистограммы по (метрика, view), общие для потоков процесса.
+
+    collectors - функции без аргументов, которые возвращают готовые
+    строки других метрик (например, пула соединений с бд).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.collectors = []
+
+    def observe(self, view, values):
+        with self.lock:
+            for metric, value in values.items():
+                bounds = HISTOGRAMS[metric][2]
+                series = self.series.get((metric, view))
+                if series is None:
+                    series = self.series[(metric, view)] = new_series(bounds)
+                observe(series, bounds, value)
+
+    def render(self):
+        with self.lock:
+            snapshot = {
+                key: {**series, "buckets": list(series["buckets"])}
+                for key, series in self.series.items()
+            }
+        lines = []
+        for metric, (name, description, bounds) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for (key, view), series in sorted(snapshot.items()):
+                if key == metric:
+                    lines.extend(
+                        histogram_lines(name, f'view="{view}"', bounds, series)
+                    )
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db += time.perf_counter() - started
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # в начало списка: execute_wrapper() снимает обертки с конца
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def install():
+    """Обертка на уже открытые соединения потока и на все новые"""
+    for connection in connections.all(initialized_only=True):
+        install_query_recorder(None, connection)
+    connection_created.connect(install_query_recorder)
+
+
+def view_name(view_func, method):
+    """Имя вида Класс.действие для view DRF, иначе модуль.функция"""
+    view_func = getattr(view_func, "sync_view", view_func)
+    cls = getattr(view_func, "cls", None)
+    if cls is None:
+        return f"{view_func.__module__}.{view_func.__qualname__}"
+    action = method.lower()
+    actions = getattr(view_func, "actions", None)
+    if actions:
+        action = actions.get(action, action)
+    return f"{cls.__name__}.{action}"
+
+
+class TimedSerializerMixin:
+    """Считает время to_representation; вложенные вызовы не суммируются"""
+
+    def to_representation(self, instance):
+        metrics = current.get()
+        if metrics is None or metrics.depth:
+            return super().to_representation(instance)
+        metrics.depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.depth -= 1
+            metrics.serializer += time.perf_counter() - started
@@ -0,0 +1,184 @@
+import re
+from gzip import GzipFile
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import (
+    StreamingBuffer,
+    compress_sequence,
+    compress_string
+)
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, без него остается gzip
+    brotli = None
+
+from . import metrics
+
+re_accepts_gzip = _lazy_re_compile(r"\bgzip\b")
+re_accepts_brotli = _lazy_re_compile(r"\bbr\b")
+re_compressible = re.compile(r"^(application/json|text/)")
+
+
+async def acompress_sequence(sequence):
+    """compress_sequence для асинхронных потоковых ответов (ASGI)"""
+    buf = StreamingBuffer()
+    with GzipFile(mode="wb", compresslevel=6, fileobj=buf, mtime=0) as zfile:
+        yield buf.read()
+        async for item in sequence:
+            zfile.write(item)
+            data = buf.read()
+            if data:
+                yield data
+    yield buf.read()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Сжимает json и текстовые ответы brotli или gzip.
+
+    Работает как django.middleware.gzip.GZipMiddleware, но сжимает только
+    ответы больше COMPRESSION_MIN_SIZE байт и предпочитает brotli, если
+    клиент его принимает и пакет установлен.
+    """
+
+    def process_response(self, request, response):
+        if response.has_header("Content-Encoding"):
+            return response
+        if not re_compressible.match(response.get("Content-Type", "")):
+            return response
+        if (not response.streaming
+                and len(response.content) < settings.COMPRESSION_MIN_SIZE):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        accepts_gzip = bool(re_accepts_gzip.search(accept_encoding))
+        accepts_brotli = (brotli is not None
+                          and bool(re_accepts_brotli.search(accept_encoding)))
+
+        if response.streaming:
+            # потоковые ответы (список покупок) сжимаются gzip по частям
+            if not accepts_gzip:
+                return response
+            encoding = "gzip"
+            if response.is_async:
+                response.streaming_content = acompress_sequence(
+                    response.streaming_content
+                )
+            else:
+                response.streaming_content = compress_sequence(
+                    response.streaming_content
+                )
+            del response.headers["Content-Length"]
+        elif accepts_brotli or accepts_gzip:
+            if accepts_brotli:
+                encoding = "br"
+                compressed = brotli.compress(response.content)
+            else:
+                encoding = "gzip"
+                compressed = compress_string(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(response.content))
+        else:
+            return response
+
+        # сжатие меняет байты ответа, поэтому сильный ETag становится слабым
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+class MetricsMiddleware:
+    """Собирает метрики запроса (foodgram/metrics.py).
+
+    Стоит первой в MIDDLEWARE, чтобы total включал всю обработку, а size
+    был размером уже сжатого ответа. Для потоковых ответов гистограммы
+    пишутся после отдачи последнего куска, а Server-Timing содержит время
+    до начала отдачи.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS:
+            raise MiddlewareNotUsed
+        metrics.install()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        collected = metrics.RequestMetrics()
+        metrics.current.set(collected)
+        return self.finish(self.get_response(request), collected)
+
+    async def __acall__(self, request):
+        collected = metrics.RequestMetrics()
+        metrics.current.set(collected)
+        return self.finish(await self.get_response(request), collected)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        collected = metrics.current.get()
+        if collected is not None:
+            collected.view = metrics.view_name(view_func, request.method)
+
+    def finish(self, response, collected):
+        if settings.SERVER_TIMING:
+            response.headers["Server-Timing"] = collected.server_timing(
+                collected.elapsed()
+            )
+        if not response.streaming:
+            metrics.current.set(None)
+            metrics.registry.observe(
+                collected.view,
+                collected.values(collected.elapsed(), len(response.content))
+            )
+        elif response.is_async:
+            response.streaming_content = self.ameasure(
+                response.streaming_content, collected
+            )
+        else:
+            response.streaming_content = self.measure(
+                response.streaming_content, collected
+            )
+        return response
+
+    @staticmethod
+    def measure(content, collected):
+        size = 0
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            metrics.current.set(None)
+            metrics.registry.observe(
+                collected.view,
+                collected.values(collected.elapsed(), size)
+            )
+
+    @staticmethod
+    async def ameasure(content, collected):
+        size = 0
+        try:
+            async for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            metrics.current.set(None)
+            metrics.registry.observe(
+                collected.view,
+                collected.values(collected.elapsed(), size)
+            )
@@ -53,7 +53,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'foodgram.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -94,13 +96,100 @@ DATABASES = {
     }
 }
 
+# SQL-запрос веб-запроса дольше DB_STATEMENT_TIMEOUT мс отменяется
+# сервером, чтобы медленный запрос не держал соединение; команды
+# manage.py не ограничены (foodgram.db.timeouts); 0 - без ограничения
+DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', default=10000))
+
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default']['OPTIONS'] = {}
+    if os.getenv('DB_POOL', default='True') == 'True':
+        # пул соединений на процесс (foodgram.db.pool), соединение
+        # возвращается в пул в конце каждого запроса
+        DATABASES['default']['ENGINE'] = 'foodgram.db.postgresql'
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'size': int(os.getenv('DB_POOL_SIZE', default=10)),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', default=5)),
+            'max_lifetime': int(
+                os.getenv('DB_POOL_MAX_LIFETIME', default=1800)
+            ),
+            'check_interval': int(
+                os.getenv('DB_POOL_CHECK_INTERVAL', default=30)
+            ),
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(
+            os.getenv('DB_CONN_MAX_AGE', default=60)
+        )
+        DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# по умолчанию кэш в памяти процесса; в продакшене нужен общий кэш
+# (redis, memcached), иначе версии данных у воркеров расходятся
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+
+# кэш ответов для анонимных пользователей (web_site.mixins)
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', default=300))
+RESPONSE_CACHE_SERVE_STALE = (
+    os.getenv('RESPONSE_CACHE_SERVE_STALE', default='True') == 'True'
+)
+RESPONSE_CACHE_LOCK_TIMEOUT = 10
+RESPONSE_CACHE_WAIT = 2
+
+# окна рейтинга популярности (web_site.popularity, ?ordering=popular):
+# за сколько дней учитывать избранное и корзины и за сколько часов вес
+# события падает вдвое; None - без затухания, просто сумма за окно
+POPULARITY_WINDOWS = {
+    'trending': {
+        'days': int(os.getenv('POPULARITY_TRENDING_DAYS', default=7)),
+        'half_life_hours': float(
+            os.getenv('POPULARITY_TRENDING_HALF_LIFE_HOURS', default=24)
+        ),
+    },
+    'week': {'days': 7, 'half_life_hours': None},
+}
+POPULARITY_DEFAULT_WINDOW = 'trending'
+
+# кэш общей для всех пользователей части рецептов (web_site.fragments)
+RECIPE_FRAGMENT_CACHE_ALIAS = 'default'
+RECIPE_FRAGMENT_CACHE_TIMEOUT = int(
+    os.getenv('RECIPE_FRAGMENT_CACHE_TIMEOUT', default=3600)
+)
+
+# json и текстовые ответы меньше этого размера не сжимаются
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', default=1024))
+
+# асинхронные GET-эндпоинты (web_site.async_views) на тех же адресах;
+# имеет смысл только под ASGI-сервером, см. entrypoint.sh
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', default='False') == 'True'
+
+# кэш аутентификации по токену (users.authentication): записей в памяти
+# процесса, их время жизни в секундах и необязательный общий кэш
+TOKEN_AUTH_CACHE_SIZE = int(os.getenv('TOKEN_AUTH_CACHE_SIZE', default=10000))
+TOKEN_AUTH_CACHE_TTL = int(os.getenv('TOKEN_AUTH_CACHE_TTL', default=300))
+TOKEN_AUTH_SHARED_CACHE = os.getenv('TOKEN_AUTH_SHARED_CACHE') or None
+
+# метрики запросов (foodgram.metrics): гистограммы на /api/metrics/ для
+# персонала и заголовок Server-Timing в каждом ответе
+REQUEST_METRICS = os.getenv('REQUEST_METRICS', default='True') == 'True'
+SERVER_TIMING = os.getenv('SERVER_TIMING', default='True') == 'True'
+
 SWAGGER_SETTINGS = {
     'USE_SESSION_AUTH': False
 }
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.TokenAuthentication',
     ],
     "DEFAULT_PAGINATION_CLASS":
         "rest_framework.pagination.PageNumberPagination",
@@ -145,4 +234,18 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# копии фото рецептов: наибольшие ширина и высота для каждого размера
+RECIPE_IMAGE_SIZES = {
+    'thumbnail': (160, 160),
+    'card': (600, 600),
+    'full': (1600, 1600),
+}
+RECIPE_IMAGE_QUALITY = 80
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', default=2))
+# False - копии делаются сразу в запросе (удобно для команд и отладки)
+RECIPE_IMAGE_ASYNC = True
+
+# конфигурация полнотекстового поиска Postgres (стемминг, стоп-слова)
+RECIPE_SEARCH_CONFIG = os.getenv('RECIPE_SEARCH_CONFIG', default='russian')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
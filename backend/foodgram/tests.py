@@ -0,0 +1,168 @@
+import threading
+from unittest import mock
+
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+
+from foodgram.db import pool, timeouts
+from foodgram.db.postgresql import base
+
+
+class StatementTimeoutTests(SimpleTestCase):
+
+    def connection(self, vendor="postgresql"):
+        connection = mock.MagicMock(vendor=vendor)
+        cursor = connection.cursor.return_value.__enter__.return_value
+        return connection, cursor
+
+    @override_settings(DB_STATEMENT_TIMEOUT=2500)
+    def test_sets_timeout(self):
+        connection, cursor = self.connection()
+        timeouts.set_statement_timeout(None, connection)
+        cursor.execute.assert_called_once_with(
+            "SET statement_timeout = 2500"
+        )
+
+    @override_settings(DB_STATEMENT_TIMEOUT=0)
+    def test_disabled(self):
+        connection, cursor = self.connection()
+        timeouts.set_statement_timeout(None, connection)
+        cursor.execute.assert_not_called()
+
+    @override_settings(DB_STATEMENT_TIMEOUT=2500)
+    def test_other_vendors(self):
+        connection, cursor = self.connection("sqlite")
+        timeouts.set_statement_timeout(None, connection)
+        cursor.execute.assert_not_called()
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def make_pool(self, **options):
+        self.checks = []
+        self.resets = []
+        options = {"size": 2, "timeout": 0.05, **options}
+        return pool.ConnectionPool(
+            "test",
+            check=lambda connection: self.checks.append(connection) or True,
+            reset=lambda connection: self.resets.append(connection) or True,
+            **options
+        )
+
+    def test_checkin_and_reuse(self):
+        connections = self.make_pool()
+        first = connections.checkout(FakeConnection)
+        connections.checkin(first)
+        self.assertEqual(self.resets, [first])
+        self.assertIs(connections.checkout(FakeConnection), first)
+        self.assertFalse(first.closed)
+        self.assertEqual(connections.snapshot()["checkouts"], 2)
+
+    def test_exhausted(self):
+        connections = self.make_pool(size=1)
+        connections.checkout(FakeConnection)
+        with self.assertRaises(pool.PoolExhausted):
+            connections.checkout(FakeConnection)
+        self.assertEqual(connections.snapshot()["exhausted"], 1)
+
+    def test_exhausted_is_operational_error(self):
+        connections = self.make_pool(size=1)
+        connections.checkout(FakeConnection)
+        wrapper = base.DatabaseWrapper({
+            **connection.settings_dict,
+            "ENGINE": "foodgram.db.postgresql",
+            "OPTIONS": {"pool": {}},
+        }, "pool_test")
+        with mock.patch.object(wrapper, "get_pool", return_value=connections):
+            with self.assertRaises(base.Database.OperationalError):
+                wrapper.get_new_connection({})
+
+    def test_waits_for_checkin(self):
+        connections = self.make_pool(size=1, timeout=5)
+        first = connections.checkout(FakeConnection)
+        threading.Timer(0.05, connections.checkin, [first]).start()
+        self.assertIs(connections.checkout(FakeConnection), first)
+
+    def test_max_lifetime(self):
+        connections = self.make_pool(max_lifetime=0)
+        first = connections.checkout(FakeConnection)
+        connections.checkin(first)
+        self.assertTrue(first.closed)
+        self.assertIsNot(connections.checkout(FakeConnection), first)
+
+    def test_broken_and_failed_reset_are_closed(self):
+        connections = self.make_pool()
+        first = connections.checkout(FakeConnection)
+        connections.checkin(first, broken=True)
+        self.assertTrue(first.closed)
+        connections.reset = lambda connection: False
+        second = connections.checkout(FakeConnection)
+        connections.checkin(second)
+        self.assertTrue(second.closed)
+        self.assertEqual(connections.snapshot()["idle"], 0)
+
+    def test_stale_connection_is_checked(self):
+        connections = self.make_pool(check_interval=0)
+        first = connections.checkout(FakeConnection)
+        connections.checkin(first)
+        connections.check = lambda connection: False
+        second = connections.checkout(FakeConnection)
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(connections.snapshot()["failed_checks"], 1)
+
+    def test_collect(self):
+        key = ("pool_test", "collect")
+        self.addCleanup(pool.pools.pop, key, None)
+        connections = pool.get_pool(
+            key, "collect", check=None, reset=lambda connection: True, size=3
+        )
+        connections.checkin(connections.checkout(FakeConnection))
+        connections.checkout(FakeConnection)
+        lines = pool.collect()
+        for line in (
+            'foodgram_db_pool_size{pool="collect"} 3',
+            'foodgram_db_pool_connections{pool="collect",state="idle"} 0',
+            'foodgram_db_pool_connections{pool="collect",state="in_use"} 1',
+            'foodgram_db_pool_checkouts_total{pool="collect"} 2',
+            'foodgram_db_pool_exhausted_total{pool="collect"} 0',
+            'foodgram_db_pool_wait_seconds_count{pool="collect"} 2',
+        ):
+            self.assertIn(line, lines)
+
+
+class PostgresConnectionChecksTests(SimpleTestCase):
+
+    def test_check(self):
+        healthy = mock.MagicMock()
+        healthy.info.transaction_status = base.IDLE
+        self.assertTrue(base.check(healthy))
+        broken = mock.MagicMock()
+        broken.cursor.side_effect = base.Database.OperationalError
+        self.assertFalse(base.check(broken))
+
+    def test_reset_rolls_back(self):
+        in_transaction = mock.MagicMock()
+        in_transaction.info.transaction_status = 2
+
+        def rollback():
+            in_transaction.info.transaction_status = base.IDLE
+
+        in_transaction.rollback.side_effect = rollback
+        self.assertTrue(base.reset(in_transaction))
+        in_transaction.rollback.assert_called_once_with()
+
+    def test_reset_broken(self):
+        broken = mock.MagicMock()
+        broken.info.transaction_status = 3
+        broken.rollback.side_effect = base.Database.InterfaceError
+        self.assertFalse(base.reset(broken))
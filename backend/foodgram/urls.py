@@ -20,6 +20,8 @@ from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
+from .views import MetricsView
+
 schema_view = get_schema_view(
     openapi.Info(
         title="Snippets API",
@@ -36,6 +38,7 @@ urlpatterns = [
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('admin/', admin.site.urls),
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
     path('api/', include("users.urls")),
     path('api/', include("web_site.urls")),
 ]
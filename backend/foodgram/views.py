@@ -0,0 +1,35 @@
+from rest_framework import renderers
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+from .metrics import registry
+
+
+class PrometheusRenderer(renderers.BaseRenderer):
+    media_type = "text/plain"
+    format = "txt"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = data.get("detail", "")
+        return str(data)
+
+
+class MetricsView(APIView):
+    """Гистограммы запросов в формате Prometheus, только для персонала"""
+    authentication_classes = (
+        *api_settings.DEFAULT_AUTHENTICATION_CLASSES,
+        SessionAuthentication,
+    )
+    permission_classes = (IsAdminUser,)
+    renderer_classes = (PrometheusRenderer,)
+
+    def get(self, request):
+        return Response(
+            registry.render(),
+            content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
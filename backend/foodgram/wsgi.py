@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+# после настройки Django: таймаут запросов только для веб-сервера
+from foodgram.db import timeouts  # noqa: E402
+
+timeouts.enable()
@@ -0,0 +1,222 @@
+"""Аутентификация по токену с кэшем токен -> пользователь.
+
+Каждый запрос с токеном раньше делал join token/user в бд. Теперь
+пользователь берется из LRU в памяти процесса (TOKEN_AUTH_CACHE_SIZE
+записей, живут TOKEN_AUTH_CACHE_TTL секунд), а при промахе - из общего
+кэша TOKEN_AUTH_SHARED_CACHE, если он задан. Запись действительна, пока
+не изменилась версия versions.auth(user_id): ее поднимают сигналы при
+сохранении и удалении пользователя (смена пароля, деактивация) и при
+удалении токена (выход через djoser), так что изменения видны всем
+процессам на следующем же запросе.
+"""
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication, exceptions
+from rest_framework.authentication import get_authorization_header
+
+from foodgram import metrics
+from web_site import versions
+
+SHARED_KEY_PREFIX = "users:token_auth:"
+
+
+class TokenCache:
+    """LRU с TTL: ключ токена -> (пользователь, токен, версия)"""
+
+    def __init__(self, size, ttl, shared_alias=None):
+        self.size = size
+        self.ttl = ttl
+        self.shared_alias = shared_alias
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.stats = {"local": 0, "shared": 0, "miss": 0}
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    @staticmethod
+    def shared_key(key):
+        # сам токен в имени ключа общего кэша не храним
+        return SHARED_KEY_PREFIX + hashlib.sha256(key.encode()).hexdigest()
+
+    def count(self, result):
+        with self.lock:
+            self.stats[result] += 1
+
+    def get_local(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[3] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[:3]
+
+    def set_local(self, key, user, token, version):
+        with self.lock:
+            self.entries[key] = (
+                user, token, version, time.monotonic() + self.ttl
+            )
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def forget_user(self, user_id):
+        with self.lock:
+            for key in [key for key, entry in self.entries.items()
+                        if entry[0].pk == user_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def collect(self):
+        with self.lock:
+            stats = dict(self.stats)
+        name = "foodgram_token_auth_cache_total"
+        return [
+            f"# HELP {name} Поиск токена: local и shared - попадания, "
+            f"miss - запрос в бд",
+            f"# TYPE {name} counter",
+            *(f'{name}{{result="{result}"}} {value}'
+              for result, value in stats.items()),
+        ]
+
+
+token_cache = TokenCache(
+    settings.TOKEN_AUTH_CACHE_SIZE,
+    settings.TOKEN_AUTH_CACHE_TTL,
+    settings.TOKEN_AUTH_SHARED_CACHE
+)
+metrics.registry.collectors.append(token_cache.collect)
+
+
+def invalidate_user(user_id):
+    """Сбрасывает кэш аутентификации пользователя во всех процессах.
+
+    Нужен там, где сигналы не срабатывают, например после
+    QuerySet.update(is_active=False).
+    """
+    token_cache.forget_user(user_id)
+    versions.bump_version(versions.auth(user_id))
+
+
+def copies(user, token):
+    # закэшированные объекты общие для потоков, view получают копии
+    return copy.copy(user), copy.copy(token)
+
+
+class TokenAuthentication(authentication.TokenAuthentication):
+    """TokenAuthentication DRF с кэшем и асинхронным вариантом"""
+
+    def get_key(self, request):
+        """Ключ из заголовка Authorization: Token <key> или None"""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed(
+                _("Invalid token header. No credentials provided.")
+            )
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed(
+                _("Invalid token header. "
+                  "Token string should not contain spaces.")
+            )
+        try:
+            return auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(
+                _("Invalid token header. "
+                  "Token string should not contain invalid characters.")
+            )
+
+    def authenticate(self, request):
+        key = self.get_key(request)
+        if key is None:
+            return None
+        return self.authenticate_credentials(key)
+
+    async def aauthenticate(self, request):
+        key = self.get_key(request)
+        if key is None:
+            return None
+        return await self.aauthenticate_credentials(key)
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get_local(key)
+        if entry is not None:
+            user, token, version = entry
+            if versions.get_version(versions.auth(user.pk)) == version:
+                token_cache.count("local")
+                return copies(user, token)
+        shared = token_cache.shared
+        if shared is not None:
+            entry = shared.get(token_cache.shared_key(key))
+            if entry is not None:
+                user, token, version = entry
+                if versions.get_version(versions.auth(user.pk)) == version:
+                    token_cache.count("shared")
+                    token_cache.set_local(key, user, token, version)
+                    return copies(user, token)
+        token_cache.count("miss")
+        user, token = super().authenticate_credentials(key)
+        version = versions.get_version(versions.auth(user.pk))
+        token_cache.set_local(key, user, token, version)
+        if shared is not None:
+            shared.set(
+                token_cache.shared_key(key),
+                (user, token, version),
+                token_cache.ttl
+            )
+        return copies(user, token)
+
+    async def aauthenticate_credentials(self, key):
+        entry = token_cache.get_local(key)
+        if entry is not None:
+            user, token, version = entry
+            current = await versions.aget_version(versions.auth(user.pk))
+            if current == version:
+                token_cache.count("local")
+                return copies(user, token)
+        shared = token_cache.shared
+        if shared is not None:
+            entry = await shared.aget(token_cache.shared_key(key))
+            if entry is not None:
+                user, token, version = entry
+                current = await versions.aget_version(versions.auth(user.pk))
+                if current == version:
+                    token_cache.count("shared")
+                    token_cache.set_local(key, user, token, version)
+                    return copies(user, token)
+        token_cache.count("miss")
+        token = await self.get_model().objects.select_related(
+            "user"
+        ).filter(key=key).afirst()
+        if token is None:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _("User inactive or deleted.")
+            )
+        user = token.user
+        version = await versions.aget_version(versions.auth(user.pk))
+        token_cache.set_local(key, user, token, version)
+        if shared is not None:
+            await shared.aset(
+                token_cache.shared_key(key),
+                (user, token, version),
+                token_cache.ttl
+            )
+        return copies(user, token)
@@ -1,8 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
+from foodgram.db.counters import CountersMixin
 
-class User(AbstractUser):
+
+class User(CountersMixin, AbstractUser):
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = (
         'id',
@@ -31,9 +33,21 @@ class User(AbstractUser):
         max_length=30,
         blank=False
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name="Число рецептов",
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name="Число подписчиков",
+        default=0,
+        editable=False
+    )
+
+    counter_fields = ("recipes_count", "followers_count")
 
 
-class Follow(models.Model):
+class Follow(CountersMixin, models.Model):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -1,14 +1,28 @@
 from django.contrib.auth.password_validation import validate_password
 from django.core import exceptions as django_exceptions
+from django.db.models import Manager
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
 from rest_framework.validators import UniqueTogetherValidator
 
+from foodgram.metrics import TimedSerializerMixin
+from web_site import images, viewer_state
 from web_site.models import Recipe
 from . import models
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+
+    def to_representation(self, data):
+        # подписки на всех пользователей страницы - одним запросом
+        users = list(data.all() if isinstance(data, Manager) else data)
+        state = viewer_state.get(self.context)
+        if state is not None:
+            state.expect(author_ids=[user.pk for user in users])
+        return super().to_representation(users)
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -21,15 +35,15 @@ class UserSerializer(serializers.ModelSerializer):
             "last_name",
             "is_subscribed",
         )
+        list_serializer_class = UserListSerializer
 
     def get_is_subscribed(self, obj):
-        if (self.context.get('request')
-                and not self.context['request'].user.is_anonymous):
-            return models.Follow.objects.filter(
-                user=self.context['request'].user,
-                following=obj
-            ).exists()
-        return False
+        state = viewer_state.get(self.context)
+        if state is None:
+            return False
+        if hasattr(obj, "is_subscribed"):
+            return obj.is_subscribed
+        return state.is_subscribed(obj.pk)
 
 
 class PasswordSerializer(serializers.Serializer):
@@ -53,6 +67,7 @@ class PasswordSerializer(serializers.Serializer):
 
 class RecipeWithOutIngredientsSerializer(serializers.ModelSerializer):
     """Рецепт без ингредиентов"""
+    image = serializers.SerializerMethodField("get_image")
 
     class Meta:
         model = Recipe
@@ -63,6 +78,13 @@ class RecipeWithOutIngredientsSerializer(serializers.ModelSerializer):
             "cooking_time"
         )
 
+    def get_image(self, obj):
+        return images.derivative_url(
+            obj,
+            "thumbnail",
+            self.context.get("request")
+        )
+
 
 class TokenSerializer(serializers.ModelSerializer):
     # source="key" означает, что в таблице token будет заполнено key
@@ -73,7 +95,7 @@ class TokenSerializer(serializers.ModelSerializer):
         fields = ("token",)
 
 
-class FollowerSerializer(serializers.ModelSerializer):
+class FollowerSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(
         queryset=models.User.objects.all()
     )
@@ -103,8 +125,10 @@ class FollowerSerializer(serializers.ModelSerializer):
         ]
 
 
-class ShowFollowerSerializer(serializers.ModelSerializer):
+class ShowFollowerSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
     recipes = RecipeWithOutIngredientsSerializer(
+        source="page_recipes",
         many=True,
         required=True
     )
@@ -123,18 +147,17 @@ class ShowFollowerSerializer(serializers.ModelSerializer):
             "recipes",
             "recipes_count"
         )
+        list_serializer_class = UserListSerializer
 
     """obj - подписчик, проверка пользователя на подписку"""
 
     def if_is_subscribed(self, obj):
-        request = self.context.get("request")
-        if request is None or request.user.is_anonymous:
+        state = viewer_state.get(self.context)
+        if state is None:
             return False
-        return models.Follow.objects.filter(
-            user=request.user,
-            following=obj
-        ).exists()
+        if hasattr(obj, "is_subscribed"):
+            return obj.is_subscribed
+        return state.is_subscribed(obj.pk)
 
     def get_recipes_count(self, obj):
-        count = obj.recipes.all().count()
-        return count
+        return obj.recipes_count
@@ -0,0 +1,64 @@
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .authentication import invalidate_user, token_cache
+from .models import User
+
+
+class CachedTokenTests(TestCase):
+    """Токен из кэша аутентификации перестает действовать сразу"""
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user(
+            email="cook@example.com",
+            username="cook",
+            first_name="Имя",
+            last_name="Фамилия",
+            password="secret-password-1"
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token}")
+
+    def assertCachedTokenWorks(self):
+        self.assertEqual(self.client.get("/api/users/me/").status_code, 200)
+        hits = token_cache.stats["local"]
+        self.assertEqual(self.client.get("/api/users/me/").status_code, 200)
+        self.assertEqual(token_cache.stats["local"], hits + 1)
+
+    def assertTokenRejected(self):
+        self.assertEqual(self.client.get("/api/users/me/").status_code, 401)
+
+    def test_logout(self):
+        self.assertCachedTokenWorks()
+        response = self.client.post("/api/auth/token/logout/")
+        self.assertEqual(response.status_code, 204)
+        self.assertTokenRejected()
+
+    def test_password_change(self):
+        self.assertCachedTokenWorks()
+        response = self.client.post("/api/users/set_password/", {
+            "current_password": "secret-password-1",
+            "new_password": "secret-password-2"
+        })
+        self.assertEqual(response.status_code, 200)
+        # токен остается, но пользователь из кэша уже не используется
+        misses = token_cache.stats["miss"]
+        self.assertEqual(self.client.get("/api/users/me/").status_code, 200)
+        self.assertEqual(token_cache.stats["miss"], misses + 1)
+        self.assertCachedTokenWorks()
+
+    def test_deactivation(self):
+        self.assertCachedTokenWorks()
+        self.user.is_active = False
+        self.user.save()
+        self.assertTokenRejected()
+
+    def test_deactivation_by_update(self):
+        # QuerySet.update() не вызывает сигналы - кэш сбрасывают явно
+        self.assertCachedTokenWorks()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        invalidate_user(self.user.pk)
+        self.assertTokenRejected()
@@ -1,4 +1,9 @@
 from django.contrib.auth.hashers import make_password
+from django.db.models import (
+    Prefetch,
+    Value,
+    prefetch_related_objects
+)
 from django.shortcuts import get_object_or_404
 from rest_framework import (
     status,
@@ -13,6 +18,9 @@ from rest_framework.permissions import (
 from rest_framework.response import Response
 
 from rest_framework import serializers
+from web_site import versions
+from web_site.mixins import ConditionalGetMixin
+from web_site.models import Recipe
 from .models import (
     User,
     Follow
@@ -25,11 +33,18 @@ from .serializers import (
 )
 
 
-class UserView(viewsets.ModelViewSet):
+class UserView(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = (AllowAny,)
     pagination_class = None
+    conditional_per_user = True
+
+    def get_list_validators(self):
+        version = versions.get_version(versions.USERS)
+        return (version,), version
+
+    get_detail_validators = get_list_validators
 
     @action(
         methods=["get"],
@@ -116,13 +131,32 @@ class UserView(viewsets.ModelViewSet):
             )
     def subscriptions(self, request):
         user = request.user
-        follow = Follow.objects.filter(user=user)
-        user_obj = []
-        for follow_obj in follow:
-            user_obj.append(follow_obj.following)
+        # авторы и пагинация в бд, число рецептов - счетчик User.recipes_count
+        authors = User.objects.filter(
+            following__user=user
+        ).annotate(
+            is_subscribed=Value(True)
+        ).order_by("following__id")
         paginator = PageNumberPagination()
         paginator.page_size = 6
-        result_page = paginator.paginate_queryset(user_obj, request)
+        result_page = paginator.paginate_queryset(authors, request)
+        recipes = Recipe.objects.only(
+            "id",
+            "author_id",
+            "name",
+            "image",
+            "image_thumbnail",
+            "cooking_time",
+            "pub_date"
+        ).order_by("-pub_date", "-id")
+        recipes_limit = request.query_params.get("recipes_limit")
+        if recipes_limit and recipes_limit.isdigit():
+            # срез в Prefetch - один оконный запрос на всю страницу авторов
+            recipes = recipes[:int(recipes_limit)]
+        prefetch_related_objects(
+            result_page,
+            Prefetch("recipes", recipes, to_attr="page_recipes")
+        )
         serializer = ShowFollowerSerializer(result_page, many=True,
-                                            context={"current_user": user})
+                                            context={"request": request})
         return paginator.get_paginated_response(serializer.data)
@@ -33,7 +33,7 @@ class RecipeAdmin(admin.ModelAdmin):
 
     @admin.display(description='В избранном')
     def in_favorites(self, obj):
-        return obj.favorite.count()
+        return obj.favorites_count
 
     in_favorites.short_description = "В избранном"
 
@@ -0,0 +1,280 @@
+"""Асинхронные GET-эндпоинты для работы под ASGI.
+
+При ASYNC_READ_VIEWS = True urls.py ставит эти view на адреса списка и
+деталей рецептов, тегов, ингредиентов и на скачивание списка покупок.
+GET и HEAD обслуживаются здесь через асинхронный ORM, так что медленный
+клиент не держит поток воркера; остальные методы и браузерный API
+(Accept: text/html) уходят в синхронные view DRF. Ответы совпадают
+с синхронными: те же фильтры, сериализаторы, пагинация и ETag.
+Кэш готовых ответов для анонимов (AnonymousCacheMixin) и кэш фрагментов
+рецептов (fragments.py) здесь не используются: связи рецептов
+загружаются вместе с ними.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.urls import path, re_path
+from django.utils.cache import get_conditional_response
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from users.authentication import TokenAuthentication
+from . import models, popularity, serializers, versions
+from .ingredients_index import ingredients_index
+from .mixins import make_validators, set_validators
+from .pagination import AsyncPageNumberPagination, RecipeCursorPagination
+from .tag_slugs import tag_slugs
+from .views import (
+    ShoppingListFormat,
+    filter_recipes,
+    list_validators,
+    shopping_list,
+    uses_cursor
+)
+
+renderer = JSONRenderer()
+authentication = TokenAuthentication()
+
+
+def json_response(data, status=200):
+    return HttpResponse(
+        renderer.render(data),
+        status=status,
+        content_type="application/json"
+    )
+
+
+def error_response(exc):
+    response = json_response({"detail": exc.detail}, exc.status_code)
+    if isinstance(exc, (exceptions.NotAuthenticated,
+                        exceptions.AuthenticationFailed)):
+        response["WWW-Authenticate"] = authentication.authenticate_header(
+            None
+        )
+    return response
+
+
+async def get_request(request):
+    """Request DRF с пользователем из токена для сериализаторов"""
+    result = await authentication.aauthenticate(request)
+    drf_request = Request(request)
+    drf_request.user = result[0] if result else AnonymousUser()
+    return drf_request
+
+
+async def conditional_response(request, validators, handler,
+                               per_user=False):
+    if validators is None:
+        return await handler()
+    parts, last_modified = validators
+    user = request.user
+    if per_user and user.is_authenticated:
+        state = await versions.aget_version(versions.user_state(user.id))
+        parts = (*parts, user.id, state)
+        if last_modified is not None:
+            last_modified = max(last_modified, state)
+    etag, last_modified = make_validators(parts, last_modified)
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=last_modified
+    )
+    if response is None:
+        response = await handler()
+    set_validators(response, etag, last_modified, per_user)
+    return response
+
+
+def recipe_cache_versions(pk=None, popular=False):
+    recipes = versions.RECIPES if pk is None else versions.recipe(pk)
+    names = (recipes, versions.TAGS, versions.INGREDIENTS, versions.USERS)
+    if popular:
+        names += (versions.POPULARITY,)
+    return names
+
+
+async def recipe_list(request):
+    user = request.user
+    tags = request.query_params.getlist("tags")
+    tag_ids = await sync_to_async(tag_slugs.ids)(tags) if tags else None
+    queryset = filter_recipes(request.query_params, user, tag_ids)
+    popular = popularity.requested(request.query_params)
+    current = await versions.aget_versions(
+        *recipe_cache_versions(popular=popular)
+    )
+    validators = list_validators(request.query_params, current)
+
+    async def handler():
+        if uses_cursor(request):
+            paginator = RecipeCursorPagination()
+        else:
+            paginator = AsyncPageNumberPagination()
+        recipes = queryset.with_related().with_user_flags(user)
+        if popular:
+            recipes = popularity.ranked(recipes, request.query_params)
+        page = await paginator.apaginate_queryset(recipes, request)
+        serializer = serializers.ShowRecipeSerializer(
+            page,
+            many=True,
+            context={"request": request, "fragment_cache": False}
+        )
+        return json_response(
+            paginator.get_paginated_response(serializer.data).data
+        )
+
+    return await conditional_response(request, validators, handler, True)
+
+
+async def recipe_detail(request, pk):
+    user = request.user
+    pub_date = None
+    if str(pk).isdigit():
+        pub_date = await models.Recipe.objects.filter(pk=pk).values_list(
+            "pub_date",
+            flat=True
+        ).afirst()
+    if pub_date is None:
+        raise exceptions.NotFound()
+    current = await versions.aget_versions(*recipe_cache_versions(pk))
+    validators = (
+        pk,
+        pub_date.isoformat(),
+        sorted(current.items())
+    ), max(pub_date.timestamp(), *current.values())
+
+    async def handler():
+        recipe = await models.Recipe.objects.with_related().with_user_flags(
+            user
+        ).filter(pk=pk).afirst()
+        if recipe is None:
+            raise exceptions.NotFound()
+        serializer = serializers.ShowRecipeSerializer(
+            recipe,
+            context={
+                "request": request,
+                "image_size": "full",
+                "fragment_cache": False
+            }
+        )
+        return json_response(serializer.data)
+
+    return await conditional_response(request, validators, handler, True)
+
+
+async def tag_list(request):
+    version = await versions.aget_version(versions.TAGS)
+
+    async def handler():
+        tags = [tag async for tag in models.Tag.objects.all()]
+        return json_response(
+            serializers.TagSerializers(tags, many=True).data
+        )
+
+    return await conditional_response(request, ((version,), version), handler)
+
+
+async def tag_detail(request, pk):
+    version = await versions.aget_version(versions.TAGS)
+
+    async def handler():
+        tag = await models.Tag.objects.filter(pk=pk).afirst()
+        if tag is None:
+            raise exceptions.NotFound()
+        return json_response(serializers.TagSerializers(tag).data)
+
+    return await conditional_response(request, ((version,), version), handler)
+
+
+async def ingredient_list(request):
+    version = await versions.aget_version(versions.INGREDIENTS)
+
+    async def handler():
+        # индекс в памяти; в потоке, потому что он может перечитать бд
+        name = request.query_params.get("name")
+        if not name:
+            items = await sync_to_async(ingredients_index.all)()
+        else:
+            items = await sync_to_async(ingredients_index.search)(name)
+        return json_response(items)
+
+    return await conditional_response(request, ((version,), version), handler)
+
+
+async def ingredient_detail(request, pk):
+    version = await versions.aget_version(versions.INGREDIENTS)
+
+    async def handler():
+        ingredient = await models.Ingredient.objects.filter(pk=pk).afirst()
+        if ingredient is None:
+            raise exceptions.NotFound()
+        return json_response(
+            serializers.IngredientSerializer(ingredient).data
+        )
+
+    return await conditional_response(request, ((version,), version), handler)
+
+
+async def download_shopping_cart(request):
+    if not request.user.is_authenticated:
+        raise exceptions.NotAuthenticated()
+    file_format = ShoppingListFormat(request.query_params.get("file_format"))
+    rows = shopping_list(request.user)
+
+    async def lines():
+        for line in file_format.header():
+            yield line
+        async for row in rows.aiterator():
+            yield file_format.line(row)
+
+    return file_format.response(lines())
+
+
+def read_view(handler, sync_view):
+    """GET и HEAD - асинхронно, остальное - синхронным view DRF"""
+
+    async def view(request, *args, **kwargs):
+        if (request.method not in ("GET", "HEAD")
+                or "text/html" in request.headers.get("Accept", "")):
+            return await sync_to_async(sync_view)(request, *args, **kwargs)
+        try:
+            drf_request = await get_request(request)
+            return await handler(drf_request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return error_response(exc)
+
+    # csrf_exempt в Django 4.2 не умеет оборачивать корутины
+    view.csrf_exempt = True
+    # для метрик - то же имя, что у синхронного view
+    view.sync_view = sync_view
+    return view
+
+
+ROUTER_VIEWS = {
+    "recipes-list": recipe_list,
+    "recipes-detail": recipe_detail,
+    "tags-list": tag_list,
+    "tags-detail": tag_detail,
+    "ingredients-list": ingredient_list,
+    "ingredients-detail": ingredient_detail,
+}
+
+
+def get_urlpatterns(router, download_view):
+    """Асинхронные view на адресах роутера, без вариантов с ?format"""
+    patterns = [
+        path(
+            "recipes/download_shopping_cart/",
+            read_view(download_shopping_cart, download_view),
+            name="download"
+        ),
+    ]
+    for url in router.urls:
+        if (url.name in ROUTER_VIEWS
+                and "format" not in url.pattern.regex.groupindex):
+            patterns.append(re_path(
+                url.pattern.regex.pattern,
+                read_view(ROUTER_VIEWS[url.name], url.callback),
+                name=url.name
+            ))
+    return patterns
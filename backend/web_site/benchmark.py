@@ -0,0 +1,454 @@
+"""Нагрузочный прогон API для команды benchmark_api.
+
+Наполняет тестовую бд синтетическими данными заданного размера и
+гоняет по кругу все эндпоинты web_site/urls.py и users/urls.py через
+тестовый клиент Django. Для каждого шага сохраняются перцентили
+времени ответа, число SQL-запросов и размер ответа, чтобы результаты
+двух коммитов можно было сравнить.
+"""
+import base64
+import platform
+import random
+import statistics
+import subprocess
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import timedelta
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from users.models import Follow, User
+from . import counters, models, popularity, search, shopping_totals
+from .ingredients_index import ingredients_index
+
+PASSWORD = "benchmark-Pa55"
+COLORS = ("#E26C2D", "#49B64E", "#8775D2", "#0000FF", "#FF0000", "#008000")
+BATCH_SIZE = 1000
+
+
+@dataclass
+class Dataset:
+    users: int = 200
+    recipes: int = 2000
+    tags: int = 6
+    ingredients: int = 2000
+    ingredients_per_recipe: int = 8
+    follows: int = 10
+    favorites: int = 30
+    cart: int = 10
+    seed: int = 1
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def png_bytes(size=(64, 64), color=(200, 120, 40)):
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def bulk(model, objects):
+    model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+
+
+def seed(dataset):
+    """Заполняет пустую бд. Сигналы при bulk_create не срабатывают,
+    поэтому счетчики и поисковые документы пересчитываются в конце."""
+    rnd = random.Random(dataset.seed)
+    image = default_storage.save(
+        "benchmark/recipe.png",
+        ContentFile(png_bytes())
+    )
+
+    bulk(models.Tag, [
+        models.Tag(
+            name=f"Тег {i}",
+            color=COLORS[i % len(COLORS)],
+            slug=f"tag{i}"
+        )
+        for i in range(dataset.tags)
+    ])
+    bulk(models.Ingredient, [
+        models.Ingredient(
+            name=f"ингредиент {i:05d}",
+            measurement_unit=rnd.choice(("г", "мл", "шт", "ст. л."))
+        )
+        for i in range(dataset.ingredients)
+    ])
+    password = make_password(PASSWORD)
+    bulk(User, [
+        User(
+            username=f"user{i}",
+            email=f"user{i}@example.com",
+            first_name="Имя",
+            last_name="Фамилия",
+            password=password
+        )
+        for i in range(dataset.users)
+    ])
+    user_ids = list(User.objects.order_by("pk").values_list("pk", flat=True))
+    tag_ids = list(models.Tag.objects.values_list("pk", flat=True))
+    ingredient_ids = list(
+        models.Ingredient.objects.values_list("pk", flat=True)
+    )
+
+    bulk(models.Recipe, [
+        models.Recipe(
+            author_id=rnd.choice(user_ids),
+            name=f"Рецепт {i} {rnd.choice(('суп', 'салат', 'пирог'))}",
+            text="Описание рецепта. " * rnd.randint(5, 40),
+            cooking_time=rnd.randint(5, 180),
+            image=image
+        )
+        for i in range(dataset.recipes)
+    ])
+    # bulk_create ставит всем рецептам одно время auto_now - разносим
+    now = timezone.now()
+    recipes = list(models.Recipe.objects.only("id", "pub_date"))
+    for recipe in recipes:
+        recipe.pub_date = now - timedelta(minutes=rnd.randint(0, 10 ** 6))
+    models.Recipe.objects.bulk_update(recipes, ["pub_date"], BATCH_SIZE)
+    recipe_ids = [recipe.pk for recipe in recipes]
+
+    bulk(models.TagsInRecipe, [
+        models.TagsInRecipe(recipe_id=recipe_id, tag_id=tag_id)
+        for recipe_id in recipe_ids
+        for tag_id in rnd.sample(tag_ids, rnd.randint(1, min(3, dataset.tags)))
+    ])
+    bulk(models.IngredientInRecipe, [
+        models.IngredientInRecipe(
+            recipe_id=recipe_id,
+            ingredient_id=ingredient_id,
+            amount=rnd.randint(1, 500)
+        )
+        for recipe_id in recipe_ids
+        for ingredient_id in rnd.sample(
+            ingredient_ids,
+            min(dataset.ingredients_per_recipe, len(ingredient_ids))
+        )
+    ])
+    for model, per_user, related in (
+        (models.Favorite, dataset.favorites, "recipe_id"),
+        (models.ShoppingCart, dataset.cart, "recipe_id"),
+    ):
+        bulk(model, [
+            model(user_id=user_id, **{related: recipe_id})
+            for user_id in user_ids
+            for recipe_id in rnd.sample(
+                recipe_ids,
+                min(per_user, len(recipe_ids))
+            )
+        ])
+    bulk(Follow, [
+        Follow(user_id=user_id, following_id=following_id)
+        for user_id in user_ids
+        for following_id in rnd.sample(
+            [pk for pk in user_ids if pk != user_id],
+            min(dataset.follows, len(user_ids) - 1)
+        )
+    ])
+    # ключ токена генерирует save(), bulk_create его не вызывает
+    Token.objects.bulk_create([
+        Token(user_id=pk, key=Token.generate_key()) for pk in user_ids[:3]
+    ])
+
+    counters.repair()
+    shopping_totals.repair()
+    popularity.refresh()
+    search.create_structures()
+    search.update_documents()
+    ingredients_index.invalidate()
+
+
+@dataclass
+class Context:
+    """Объекты, на которые ссылаются шаги, и состояние между шагами"""
+    reader: User
+    writer: User
+    author: User
+    recipe: models.Recipe
+    tag: models.Tag
+    ingredient: models.Ingredient
+    tokens: dict
+    state: dict = field(default_factory=dict)
+
+    def headers(self, user):
+        if user is None:
+            return {}
+        if user == "login":
+            # токен, полученный шагом token login
+            key = self.state["token"]
+        else:
+            key = self.tokens[getattr(self, user).pk]
+        return {"HTTP_AUTHORIZATION": f"Token {key}"}
+
+
+def build_context():
+    reader, writer, author = User.objects.order_by("pk")[:3]
+    recipe = models.Recipe.objects.order_by("pk").first()
+    # шаги записи добавляют эти связи сами; delete() шлет сигналы,
+    # так что счетчики остаются верными
+    models.Favorite.objects.filter(user=writer, recipe=recipe).delete()
+    models.ShoppingCart.objects.filter(user=writer, recipe=recipe).delete()
+    Follow.objects.filter(user=writer, following=author).delete()
+    return Context(
+        reader=reader,
+        writer=writer,
+        author=author,
+        recipe=recipe,
+        tag=models.Tag.objects.order_by("pk").first(),
+        ingredient=models.Ingredient.objects.order_by("pk").first(),
+        tokens=dict(Token.objects.values_list("user_id", "key")),
+    )
+
+
+@dataclass
+class Step:
+    """Один запрос прогона; path и data - значения или функции от Context"""
+    name: str
+    method: str
+    path: object
+    user: str = None
+    data: object = None
+    json: bool = False
+    after: object = None
+
+    def build(self, ctx):
+        path = self.path(ctx) if callable(self.path) else self.path
+        data = self.data(ctx) if callable(self.data) else self.data
+        extra = ctx.headers(self.user)
+        if self.json:
+            extra["content_type"] = "application/json"
+        return path, data, extra
+
+
+def recipe_payload(ctx):
+    image = base64.b64encode(png_bytes()).decode()
+    return {
+        "name": "Новый рецепт",
+        "text": "Рецепт из прогона производительности",
+        "cooking_time": 10,
+        "image": f"data:image/png;base64,{image}",
+        "tags": [ctx.tag.pk],
+        "ingredients": [{"id": ctx.ingredient.pk, "amount": 100}],
+    }
+
+
+def new_user(ctx):
+    suffix = time.time_ns()
+    return {
+        "email": f"new{suffix}@example.com",
+        "username": f"new{suffix}",
+        "first_name": "Имя",
+        "last_name": "Фамилия",
+        "password": PASSWORD,
+    }
+
+
+def remember(key, source):
+    def after(response, ctx):
+        ctx.state[key] = response.json()[source]
+    return after
+
+
+def bulk_ids(ctx):
+    # рецепт шагов записи и следующие за ним; удаление убирает все,
+    # так что после прогрева каждая итерация видит одни и те же данные
+    return {"recipes": list(range(ctx.recipe.pk, ctx.recipe.pk + 20))}
+
+
+def recipe_path(ctx):
+    return f"/api/recipes/{ctx.recipe.pk}/"
+
+
+def created_recipe_path(ctx):
+    return f"/api/recipes/{ctx.state['recipe_id']}/"
+
+
+def favorite_path(ctx):
+    return f"/api/recipes/{ctx.recipe.pk}/favorite/"
+
+
+def cart_path(ctx):
+    return f"/api/recipes/{ctx.recipe.pk}/shopping_cart/"
+
+
+def subscribe_path(ctx):
+    return f"/api/users/{ctx.author.pk}/subscribe/"
+
+
+DOWNLOAD = "/api/recipes/download_shopping_cart/"
+
+READ_STEPS = [
+    Step("recipes list anonymous", "get", "/api/recipes/"),
+    Step("recipes list", "get", "/api/recipes/", "reader"),
+    Step("recipes list page 5", "get", "/api/recipes/", "reader",
+         {"page": 5}),
+    Step("recipes list cursor", "get", "/api/recipes/", "reader",
+         {"cursor": ""}),
+    Step("recipes list tags", "get", "/api/recipes/", "reader",
+         lambda ctx: {"tags": [ctx.tag.slug]}),
+    Step("recipes list author", "get", "/api/recipes/", "reader",
+         lambda ctx: {"author": ctx.author.pk}),
+    Step("recipes list is_favorited", "get", "/api/recipes/", "reader",
+         {"is_favorited": 1}),
+    Step("recipes list is_in_shopping_cart", "get", "/api/recipes/",
+         "reader", {"is_in_shopping_cart": 1}),
+    Step("recipes search", "get", "/api/recipes/", "reader",
+         {"search": "суп"}),
+    Step("recipes list popular", "get", "/api/recipes/", "reader",
+         {"ordering": "popular"}),
+    Step("recipe detail anonymous", "get", recipe_path),
+    Step("recipe detail", "get", recipe_path, "reader"),
+    Step("download shopping cart", "get", DOWNLOAD, "reader"),
+    Step("download shopping cart csv", "get", DOWNLOAD, "reader",
+         {"file_format": "csv"}),
+    Step("tags list", "get", "/api/tags/"),
+    Step("tag detail", "get", lambda ctx: f"/api/tags/{ctx.tag.pk}/"),
+    Step("ingredients list", "get", "/api/ingredients/"),
+    Step("ingredients search", "get", "/api/ingredients/", None,
+         {"name": "ингредиент 001"}),
+    Step("ingredient detail", "get",
+         lambda ctx: f"/api/ingredients/{ctx.ingredient.pk}/"),
+    Step("users list", "get", "/api/users/", "reader"),
+    Step("user detail", "get",
+         lambda ctx: f"/api/users/{ctx.author.pk}/", "reader"),
+    Step("users me", "get", "/api/users/me/", "reader"),
+    Step("subscriptions", "get", "/api/users/subscriptions/", "reader",
+         {"recipes_limit": 3}),
+]
+
+# каждая группа возвращает данные в исходное состояние
+WRITE_STEPS = [
+    Step("favorite add", "post", favorite_path, "writer"),
+    Step("favorite remove", "delete", favorite_path, "writer"),
+    Step("shopping cart add", "post", cart_path, "writer"),
+    Step("shopping cart remove", "delete", cart_path, "writer"),
+    Step("favorite bulk add", "post", "/api/recipes/favorite/bulk/",
+         "writer", bulk_ids, json=True),
+    Step("favorite bulk remove", "delete", "/api/recipes/favorite/bulk/",
+         "writer", bulk_ids, json=True),
+    Step("shopping cart bulk add", "post",
+         "/api/recipes/shopping_cart/bulk/", "writer", bulk_ids, json=True),
+    Step("shopping cart bulk remove", "delete",
+         "/api/recipes/shopping_cart/bulk/", "writer", bulk_ids, json=True),
+    Step("subscribe", "post", subscribe_path, "writer"),
+    Step("unsubscribe", "delete", subscribe_path, "writer"),
+    Step("recipe create", "post", "/api/recipes/", "writer",
+         recipe_payload, json=True, after=remember("recipe_id", "id")),
+    Step("recipe update", "patch", created_recipe_path, "writer",
+         {"name": "Измененный рецепт", "cooking_time": 20}, json=True),
+    Step("recipe delete", "delete", created_recipe_path, "writer"),
+    Step("user create", "post", "/api/users/", None, new_user),
+    Step("token login", "post", "/api/auth/token/login/", None,
+         lambda ctx: {"email": ctx.author.email, "password": PASSWORD},
+         after=remember("token", "auth_token")),
+    Step("token logout", "post", "/api/auth/token/logout/", "login"),
+]
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга"""
+    ordered = sorted(values)
+    rank = round(percent / 100 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def summarize(samples):
+    timings = [sample["ms"] for sample in samples]
+    queries = [sample["queries"] for sample in samples]
+    sizes = [sample["bytes"] for sample in samples]
+    statuses = Counter(str(sample["status"]) for sample in samples)
+    return {
+        "requests": len(samples),
+        "statuses": dict(statuses),
+        "ms": {
+            "min": round(min(timings), 3),
+            "mean": round(statistics.fmean(timings), 3),
+            "p50": round(percentile(timings, 50), 3),
+            "p90": round(percentile(timings, 90), 3),
+            "p95": round(percentile(timings, 95), 3),
+            "p99": round(percentile(timings, 99), 3),
+            "max": round(max(timings), 3),
+        },
+        "queries": {
+            "mean": round(statistics.fmean(queries), 2),
+            "max": max(queries),
+        },
+        "bytes": {
+            "mean": round(statistics.fmean(sizes)),
+            "max": max(sizes),
+        },
+    }
+
+
+def perform(client, ctx, step):
+    path, data, extra = step.build(ctx)
+    request = getattr(client, step.method)
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = request(path, data, **extra)
+        # потоковый ответ читается целиком, вместе с его запросами
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        elapsed = time.perf_counter() - started
+    if step.after is not None and response.status_code < 400:
+        step.after(response, ctx)
+    return {
+        "ms": elapsed * 1000,
+        "queries": len(queries),
+        "bytes": size,
+        "status": response.status_code,
+    }
+
+
+def run(steps, ctx, iterations, warmup=1):
+    client = Client()
+    samples = {step.name: [] for step in steps}
+    for iteration in range(warmup + iterations):
+        for step in steps:
+            sample = perform(client, ctx, step)
+            if iteration >= warmup:
+                samples[step.name].append(sample)
+    return {name: summarize(values) for name, values in samples.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(dataset, iterations, warmup):
+    return {
+        "commit": git_commit(),
+        "created": timezone.now().isoformat(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "dataset": dataset.as_dict(),
+        "iterations": iterations,
+        "warmup": warmup,
+    }
@@ -0,0 +1,70 @@
+"""Денормализованные счетчики рецептов и пользователей.
+
+Счетчик меняется выражением F() в той же транзакции, что и запись,
+которую он считает (сигналы в signals.py, массовые операции вызывают
+add сами). Обычное save() моделей со счетчиками их не пишет, чтобы не
+затереть чужие изменения устаревшим значением. Если счетчики все же
+разошлись с данными, их пересчитывает команда repair_counters.
+"""
+from collections import Counter, defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import Follow
+from . import models
+
+User = get_user_model()
+
+# (что считаем, поле связи, у кого счетчик, поле счетчика)
+COUNTERS = (
+    (models.Favorite, "recipe_id", models.Recipe, "favorites_count"),
+    (models.ShoppingCart, "recipe_id", models.Recipe, "shopping_cart_count"),
+    (models.Recipe, "author_id", User, "recipes_count"),
+    (Follow, "following_id", User, "followers_count"),
+)
+
+
+def counted_by(source):
+    """Счетчики, которые зависят от строк модели source"""
+    return [
+        (field, target, counter)
+        for model, field, target, counter in COUNTERS
+        if model is source
+    ]
+
+
+def add(target, counter, ids, delta=1):
+    """Прибавляет delta к счетчику для каждого вхождения id в ids"""
+    by_delta = defaultdict(list)
+    for pk, times in Counter(ids).items():
+        by_delta[delta * times].append(pk)
+    for value, pks in by_delta.items():
+        target.objects.filter(pk__in=pks).update(
+            **{counter: F(counter) + value}
+        )
+
+
+def actual_count(source, field):
+    return Coalesce(
+        Subquery(
+            source.objects.filter(
+                **{field: OuterRef("pk")}
+            ).order_by().values(field).annotate(
+                total=Count("pk")
+            ).values("total")
+        ),
+        0
+    )
+
+
+def repair():
+    """Пересчитывает все счетчики, возвращает число исправленных строк"""
+    fixed = {}
+    for source, field, target, counter in COUNTERS:
+        actual = actual_count(source, field)
+        fixed[counter] = target.objects.exclude(
+            **{counter: actual}
+        ).update(**{counter: actual})
+    return fixed
@@ -0,0 +1,71 @@
+"""Кэш не зависящей от пользователя части рецепта в ответах API.
+
+Теги, ингредиенты, автор, текст и ссылка на фото у рецепта одинаковы
+для всех, от пользователя зависят только is_favorited,
+is_in_shopping_cart и author.is_subscribed. Общая часть (фрагмент)
+хранится в кэше по рецепту и его pub_date вместе с версиями рецепта,
+тегов, ингредиентов и профиля автора; если сигналы сменили одну из них,
+фрагмент считается заново. ShowRecipeSerializer достает фрагменты всей
+страницы одним get_many и добавляет флаги пользователя при ответе, так что
+страница ленты для вошедшего пользователя не сериализуется заново.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import versions
+
+KEY_PREFIX = "web_site:fragment:"
+
+
+def dependencies(recipe):
+    """Версии, от которых зависит фрагмент рецепта"""
+    return (
+        versions.recipe(recipe.pk),
+        versions.TAGS,
+        versions.INGREDIENTS,
+        versions.profile(recipe.author_id)
+    )
+
+
+def cache_key(recipe, context):
+    # ссылка на фото абсолютная, поэтому в ключе и адрес сайта
+    request = context.get("request")
+    base = request.build_absolute_uri("/") if request is not None else ""
+    site = hashlib.md5(base.encode()).hexdigest()[:12]
+    return (
+        f"{KEY_PREFIX}{recipe.pk}:{recipe.pub_date.timestamp()}:"
+        f"{context.get('image_size', 'card')}:{site}"
+    )
+
+
+def cached(recipes, context, render):
+    """Фрагменты recipes в том же порядке; render(список рецептов)
+    считает недостающие и устаревшие"""
+    # асинхронные view не ходят в кэш синхронно (async_views.py)
+    if not recipes or not context.get("fragment_cache", True):
+        return render(recipes)
+    cache = caches[settings.RECIPE_FRAGMENT_CACHE_ALIAS]
+    keys = [cache_key(recipe, context) for recipe in recipes]
+    current = versions.get_versions(*{
+        name for recipe in recipes for name in dependencies(recipe)
+    })
+    entries = cache.get_many(keys)
+    fragments = {}
+    missing = {}
+    for recipe, key in zip(recipes, keys):
+        stamp = [current[name] for name in dependencies(recipe)]
+        entry = entries.get(key)
+        if entry is not None and entry["versions"] == stamp:
+            fragments[key] = entry["data"]
+        else:
+            missing[key] = (recipe, stamp)
+    if missing:
+        rendered = render([recipe for recipe, _ in missing.values()])
+        fresh = {}
+        for (key, (_, stamp)), data in zip(missing.items(), rendered):
+            fragments[key] = data
+            fresh[key] = {"versions": stamp, "data": data}
+        cache.set_many(fresh, settings.RECIPE_FRAGMENT_CACHE_TIMEOUT)
+    return [fragments[key] for key in keys]
@@ -0,0 +1,143 @@
+"""Уменьшенные копии фотографий рецептов.
+
+После сохранения рецепта с новой фотографией пул потоков делает из нее
+копии размеров из RECIPE_IMAGE_SIZES (миниатюра, карточка, полный
+размер) в WebP, а если Pillow собран без WebP - в JPEG. Запрос на
+создание рецепта их не ждет: пока копий нет, сериализаторы отдают
+оригинал.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from PIL import Image, ImageOps, features
+
+from . import models, versions
+
+logger = logging.getLogger(__name__)
+
+SIZES = settings.RECIPE_IMAGE_SIZES
+FORMAT, EXTENSION = (
+    ("WEBP", "webp") if features.check("webp") else ("JPEG", "jpg")
+)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.RECIPE_IMAGE_WORKERS,
+    thread_name_prefix="recipe-images"
+)
+
+
+def image_field(size):
+    return f"image_{size}"
+
+
+def derivative_name(image_name, size):
+    path = PurePosixPath(image_name)
+    return str(path.parent / "derivatives" / f"{path.stem}_{size}.{EXTENSION}")
+
+
+def needs_derivatives(recipe):
+    if not recipe.image:
+        return False
+    return any(
+        getattr(recipe, image_field(size)).name
+        != derivative_name(recipe.image.name, size)
+        for size in SIZES
+    )
+
+
+def derivative(recipe, size):
+    """Копия нужного размера, а пока ее нет - оригинал"""
+    field = getattr(recipe, image_field(size))
+    if recipe.image and field.name == derivative_name(recipe.image.name, size):
+        return field
+    return recipe.image
+
+
+def derivative_url(recipe, size, request=None):
+    image = derivative(recipe, size)
+    if not image:
+        return None
+    if request is not None:
+        return request.build_absolute_uri(image.url)
+    return image.url
+
+
+def schedule_derivatives(recipe_id):
+    if settings.RECIPE_IMAGE_ASYNC:
+        executor.submit(build_in_worker, recipe_id)
+    else:
+        build_derivatives(recipe_id)
+
+
+def render(source, max_size):
+    image = source.copy()
+    image.thumbnail(max_size, Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(
+        buffer,
+        FORMAT,
+        quality=settings.RECIPE_IMAGE_QUALITY,
+        optimize=True
+    )
+    return buffer.getvalue()
+
+
+def build_derivatives(recipe_id):
+    try:
+        recipe = models.Recipe.objects.only(
+            "id",
+            "image",
+            *(image_field(size) for size in SIZES)
+        ).get(pk=recipe_id)
+        if not needs_derivatives(recipe):
+            return
+        with recipe.image.open("rb") as file:
+            source = ImageOps.exif_transpose(Image.open(file))
+            source.load()
+        if FORMAT == "JPEG":
+            source = source.convert("RGB")
+        elif source.mode not in ("RGB", "RGBA"):
+            source = source.convert("RGBA")
+
+        source_name = recipe.image.name
+        storage = recipe.image.storage
+        fields = {}
+        for size, max_size in SIZES.items():
+            old = getattr(recipe, image_field(size)).name
+            name = derivative_name(source_name, size)
+            if storage.exists(name):
+                storage.delete(name)
+            fields[image_field(size)] = storage.save(
+                name,
+                ContentFile(render(source, max_size))
+            )
+            if old and old != fields[image_field(size)]:
+                storage.delete(old)
+        # update() не трогает pub_date и не вызывает сигналы сохранения,
+        # поэтому версии для кэшей меняем сами; если фото успели
+        # заменить, копии для старого фото не записываем
+        updated = models.Recipe.objects.filter(
+            pk=recipe_id,
+            image=source_name
+        ).update(**fields)
+        if updated:
+            versions.bump_version(versions.RECIPES, versions.recipe(recipe_id))
+    except models.Recipe.DoesNotExist:
+        return
+    except FileNotFoundError:
+        logger.warning("Нет файла фото у рецепта %s", recipe_id)
+    except Exception:
+        logger.exception("Не удалось сделать копии фото рецепта %s", recipe_id)
+
+
+def build_in_worker(recipe_id):
+    try:
+        build_derivatives(recipe_id)
+    finally:
+        # у потока пула свое соединение с бд, его тоже нужно закрывать
+        close_old_connections()
@@ -0,0 +1,91 @@
+"""Индекс ингредиентов в памяти процесса для автодополнения.
+
+Каталог небольшой (пара тысяч строк), поэтому каждый воркер держит его
+целиком: отсортированный список нормализованных названий для поиска
+по префиксу через bisect и полный перебор для поиска по подстроке.
+Изменения каталога отмечаются версией в общем кэше (versions.py),
+процессы сверяются с ней не чаще CHECK_INTERVAL секунд.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from . import models, versions
+
+CHECK_INTERVAL = getattr(settings, "INGREDIENTS_INDEX_CHECK_INTERVAL", 5)
+
+
+def normalize(value):
+    """Регистр и буква ё не должны влиять на поиск"""
+    return value.strip().casefold().replace("ё", "е")
+
+
+class IngredientsIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # ключи и элементы меняются одной ссылкой, чтобы читатели
+        # в других потоках не увидели половину старого индекса
+        self._entries = ([], [])
+        self._version = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        """Сбрасывает индекс этого процесса и версию каталога для остальных"""
+        self._version = None
+        versions.bump_version(versions.INGREDIENTS)
+
+    def _build(self, version):
+        rows = models.Ingredient.objects.values_list(
+            "id",
+            "name",
+            "measurement_unit"
+        )
+        entries = sorted(
+            (
+                (normalize(name), pk),
+                {"id": pk, "name": name, "measurement_unit": measurement_unit}
+            )
+            for pk, name, measurement_unit in rows.iterator()
+        )
+        self._entries = (
+            [key for (key, _), _ in entries],
+            [item for _, item in entries]
+        )
+        self._version = version
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < CHECK_INTERVAL:
+            return
+        with self._lock:
+            version = versions.get_version(versions.INGREDIENTS)
+            if self._version != version:
+                self._build(version)
+            self._checked_at = now
+
+    def all(self):
+        self._ensure_fresh()
+        return list(self._entries[1])
+
+    def search(self, name):
+        """Сначала совпадения по началу названия, затем по подстроке"""
+        self._ensure_fresh()
+        keys, items = self._entries
+        query = normalize(name)
+        if not query:
+            return list(items)
+        start = bisect_left(keys, query)
+        end = start
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        contains = [
+            item for key, item in zip(keys, items)
+            if query in key and not key.startswith(query)
+        ]
+        return items[start:end] + contains
+
+
+ingredients_index = IngredientsIndex()
@@ -0,0 +1,135 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import QueryDict
+
+from web_site import models
+from web_site.views import filter_recipes, shopping_list
+
+User = get_user_model()
+
+# признаки плохого плана: полный просмотр таблицы и сортировка в памяти
+PLAN_ISSUES = {
+    "postgresql": (
+        (re.compile(r"Seq Scan on (\w+)"), "последовательное сканирование"),
+        (re.compile(r"(^|->)\s*(Incremental )?Sort\s+\("), "сортировка"),
+    ),
+    "sqlite": (
+        # SCAN по индексу (USING INDEX) - аналог Index Scan, его не отмечаем
+        (re.compile(r"\bSCAN (\w+)\s*$"), "последовательное сканирование"),
+        (re.compile(r"USE TEMP B-TREE FOR (ORDER BY|DISTINCT|GROUP BY)"),
+         "сортировка"),
+    ),
+}
+
+
+def catalogue(user_id, tag, recipe_id):
+    """Запросы, которые выполняет проект на горячих путях; где можно,
+    они строятся теми же функциями, что и во view"""
+    return (
+        (
+            "Лента рецептов: ORDER BY -pub_date, -id",
+            models.Recipe.objects.order_by("-pub_date", "-id")[:6]
+        ),
+        (
+            "Лента рецептов с фильтром по тегу",
+            filter_recipes(
+                QueryDict(f"tags={tag.slug if tag else ''}"),
+                AnonymousUser(),
+                [tag.pk] if tag else []
+            ).order_by("-pub_date", "-id")[:6]
+        ),
+        (
+            "Избранное пользователя по when_added",
+            models.Favorite.objects.filter(
+                user_id=user_id
+            ).order_by("when_added")
+        ),
+        (
+            "Корзина пользователя по when_added",
+            models.ShoppingCart.objects.filter(
+                user_id=user_id
+            ).order_by("when_added")
+        ),
+        (
+            "TagsInRecipe по (tag, recipe)",
+            models.TagsInRecipe.objects.filter(
+                tag=tag,
+                recipe_id=recipe_id
+            )
+        ),
+        (
+            "Список покупок пользователя",
+            shopping_list(user_id)
+        ),
+        (
+            "Подписки пользователя",
+            User.objects.filter(
+                following__user_id=user_id
+            ).order_by("following__id")[:6]
+        ),
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Выполняет EXPLAIN для каталога запросов проекта и отмечает "
+        "последовательные сканирования и сортировки. Планы имеют смысл "
+        "только на базе с данными, близкими к продакшену."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--no-analyze",
+            action="store_true",
+            help="Не выполнять запросы (EXPLAIN без ANALYZE на Postgres)"
+        )
+        parser.add_argument(
+            "--fail-on-issues",
+            action="store_true",
+            help="Завершиться с ошибкой, если найдены проблемы"
+        )
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in PLAN_ISSUES:
+            raise CommandError(f"Аудит не поддерживает базу {vendor}")
+        explain_options = {}
+        if vendor == "postgresql" and not options["no_analyze"]:
+            explain_options = {"analyze": True, "buffers": True}
+
+        user_id = User.objects.values_list("pk", flat=True).first() or 0
+        tag = models.Tag.objects.first()
+        recipe_id = models.Recipe.objects.values_list(
+            "pk",
+            flat=True
+        ).first() or 0
+
+        problems = 0
+        for label, queryset in catalogue(user_id, tag, recipe_id):
+            plan = queryset.explain(**explain_options)
+            issues = self.find_issues(vendor, plan)
+            problems += bool(issues)
+            style = self.style.WARNING if issues else self.style.SUCCESS
+            self.stdout.write(style(f"== {label}"))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(plan)
+            for issue in issues:
+                self.stdout.write(self.style.WARNING(f"  ! {issue}"))
+            self.stdout.write("")
+
+        summary = f"Запросов с проблемами: {problems}"
+        if problems and options["fail_on_issues"]:
+            raise CommandError(summary)
+        self.stdout.write(summary)
+
+    def find_issues(self, vendor, plan):
+        issues = []
+        for line in plan.splitlines():
+            for pattern, description in PLAN_ISSUES[vendor]:
+                if pattern.search(line):
+                    issues.append(f"{description}: {line.strip()}")
+        return issues
@@ -0,0 +1,137 @@
+import json
+import shutil
+import tempfile
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from web_site import benchmark
+
+COMPARED = (("ms", "p50"), ("ms", "p95"), ("queries", "mean"))
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный прогон API на синтетических данных в отдельной "
+        "тестовой бд, результат - JSON для сравнения коммитов"
+    )
+
+    def add_arguments(self, parser):
+        defaults = benchmark.Dataset()
+        for name, value in defaults.as_dict().items():
+            parser.add_argument(
+                f"--{name.replace('_', '-')}",
+                type=int,
+                default=value,
+                dest=name
+            )
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--output", default="benchmark.json")
+        parser.add_argument(
+            "--compare",
+            help="JSON прошлого прогона, с которым сравнить результат"
+        )
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="Не удалять тестовую бд после прогона"
+        )
+        parser.add_argument(
+            "--read-only",
+            action="store_true",
+            help="Только GET-запросы"
+        )
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 1:
+            raise CommandError("--iterations должно быть больше нуля")
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as file:
+                baseline = json.load(file)
+
+        dataset = benchmark.Dataset(**{
+            name: options[name] for name in benchmark.Dataset().as_dict()
+        })
+        steps = benchmark.READ_STEPS
+        if not options["read_only"]:
+            steps = steps + benchmark.WRITE_STEPS
+
+        setup_test_environment()
+        media_root = tempfile.mkdtemp(prefix="benchmark-media-")
+        old_name = connection.settings_dict["NAME"]
+        # прогон всегда идет в чистой тестовой бд, рабочие данные не трогаем
+        connection.creation.create_test_db(
+            verbosity=0,
+            autoclobber=True,
+            serialize=False
+        )
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                for cache in caches.all():
+                    cache.clear()
+                self.stdout.write("Заполнение бд...")
+                benchmark.seed(dataset)
+                ctx = benchmark.build_context()
+                self.stdout.write(
+                    f"Прогон: {len(steps)} шагов x {options['iterations']}"
+                )
+                results = benchmark.run(
+                    steps,
+                    ctx,
+                    options["iterations"],
+                    options["warmup"]
+                )
+                meta = benchmark.metadata(
+                    dataset,
+                    options["iterations"],
+                    options["warmup"]
+                )
+        finally:
+            if not options["keepdb"]:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+            teardown_test_environment()
+
+        with open(options["output"], "w", encoding="utf-8") as file:
+            json.dump(
+                {"meta": meta, "results": results},
+                file,
+                ensure_ascii=False,
+                indent=2
+            )
+        self.report(results, baseline)
+        self.stdout.write(self.style.SUCCESS(
+            f"Результат записан в {options['output']}"
+        ))
+
+    def report(self, results, baseline):
+        previous = baseline["results"] if baseline else {}
+        header = f"{'шаг':<36} {'p50 мс':>9} {'p95 мс':>9} {'запросы':>8}"
+        if baseline:
+            header += "  изменение p50 / p95 / запросы"
+        self.stdout.write(header)
+        for name, result in results.items():
+            values = [result[group][key] for group, key in COMPARED]
+            line = f"{name:<36} {values[0]:>9.2f} {values[1]:>9.2f} " \
+                   f"{values[2]:>8.1f}"
+            if name in previous:
+                old = [previous[name][group][key] for group, key in COMPARED]
+                line += "  " + " / ".join(
+                    self.delta(new, was) for new, was in zip(values, old)
+                )
+            if any(not status.startswith(("2", "3"))
+                   for status in result["statuses"]):
+                line += f"  статусы {result['statuses']}"
+                line = self.style.WARNING(line)
+            self.stdout.write(line)
+
+    @staticmethod
+    def delta(new, old):
+        if not old:
+            return f"{new - old:+.2f}"
+        return f"{(new - old) / old:+.0%}"
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from web_site import images, models
+
+
+class Command(BaseCommand):
+    help = "Делает недостающие уменьшенные копии фото рецептов"
+
+    def handle(self, *args, **options):
+        recipes = models.Recipe.objects.only(
+            "id",
+            "image",
+            *(images.image_field(size) for size in images.SIZES)
+        )
+        recipe_ids = [
+            recipe.pk for recipe in recipes.iterator()
+            if images.needs_derivatives(recipe)
+        ]
+        for recipe_id in recipe_ids:
+            images.build_derivatives(recipe_id)
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано рецептов: {len(recipe_ids)}"
+        ))
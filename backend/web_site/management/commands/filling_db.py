@@ -1,10 +1,167 @@
-from django.core.management.base import BaseCommand
-from web_site import models
+import csv
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from web_site import models, search
+from web_site.ingredients_index import ingredients_index
+
+
+def read_csv(path):
+    with open(path, 'r', encoding="utf-8", newline="") as file:
+        for row in csv.reader(file):
+            if len(row) >= 2:
+                yield row[0], row[1]
+
+
+def read_json(path):
+    # файл - один json-массив, поэтому читается целиком
+    with open(path, 'r', encoding="utf-8") as file:
+        for item in json.load(file):
+            yield item["name"], item["measurement_unit"]
+
+
+READERS = {
+    ".csv": read_csv,
+    ".json": read_json,
+}
 
 
 class Command(BaseCommand):
+    help = "Загружает каталог ингредиентов из csv или json"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            nargs="?",
+            default="ingredients.csv",
+            help="Путь к ingredients.csv или ingredients.json"
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Сколько строк вставлять одним запросом"
+        )
+
     def handle(self, *args, **options):
-        with open("ingredients.csv", 'r', encoding="utf-8") as file:
-            for line in file:
-                element = line.split(",")
-                models.Ingredient.objects.get_or_create(name=element[0], measurement_unit=element[1])
+        path = Path(options["path"])
+        reader = READERS.get(path.suffix.lower())
+        if reader is None:
+            raise CommandError(f"Неизвестный формат файла: {path}")
+        if not path.exists():
+            raise CommandError(f"Файл не найден: {path}")
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size должен быть больше нуля")
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            stats = self.load(reader(path), batch_size)
+            transaction.on_commit(ingredients_index.invalidate)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано строк: {stats['rows']} "
+            f"за {elapsed:.2f} с ({stats['rows'] / elapsed:.0f} строк/с). "
+            f"Добавлено: {stats['inserted']}, "
+            f"обновлено: {stats['updated']}, "
+            f"объединено дублей: {stats['merged']}, "
+            f"пропущено: {stats['skipped']}"
+        ))
+
+    def load(self, rows, batch_size):
+        # ключ каталога - пара (название, единица измерения) без пробелов;
+        # старый загрузчик оставлял в единице измерения перевод строки
+        groups = defaultdict(list)
+        for pk, name, unit in models.Ingredient.objects.values_list(
+                "pk", "name", "measurement_unit"
+        ).order_by("pk").iterator():
+            groups[(name.strip(), unit.strip())].append((pk, name, unit))
+        stats = {"rows": 0, "updated": 0, "merged": 0}
+        existing = {}
+        for key, group in groups.items():
+            # остается строка без пробелов, если она есть, иначе первая
+            group.sort(key=lambda row: (row[1:] != key, row[0]))
+            existing[key] = group[0]
+            if len(group) > 1:
+                self.merge(group[0][0], [row[0] for row in group[1:]])
+                stats["merged"] += len(group) - 1
+        count_before = models.Ingredient.objects.count()
+
+        to_create = []
+        to_update = []
+        seen = set()
+        for name, unit in rows:
+            stats["rows"] += 1
+            key = (name.strip(), unit.strip())
+            if key in seen:
+                continue
+            seen.add(key)
+            if key not in existing:
+                to_create.append(
+                    models.Ingredient(name=key[0], measurement_unit=key[1])
+                )
+                if len(to_create) >= batch_size:
+                    self.insert(to_create, batch_size)
+                    to_create = []
+                continue
+            pk, stored_name, stored_unit = existing[key]
+            if (stored_name, stored_unit) != key:
+                to_update.append(models.Ingredient(
+                    pk=pk, name=key[0], measurement_unit=key[1]
+                ))
+        self.insert(to_create, batch_size)
+        if to_update:
+            models.Ingredient.objects.bulk_update(
+                to_update,
+                ["name", "measurement_unit"],
+                batch_size=batch_size
+            )
+            stats["updated"] = len(to_update)
+            # bulk_update не вызывает сигналы - поиск обновляем сами
+            search.schedule_update(
+                models.IngredientInRecipe.objects.filter(
+                    ingredient_id__in=[item.pk for item in to_update]
+                ).values_list("recipe_id", flat=True).distinct()
+            )
+        stats["inserted"] = models.Ingredient.objects.count() - count_before
+        # пропущены повторы, уже загруженные строки и строки,
+        # которые параллельно успел вставить другой загрузчик
+        stats["skipped"] = stats["rows"] - stats["inserted"] - stats["updated"]
+        return stats
+
+    def merge(self, keep, duplicates):
+        """Переводит рецепты с дублей ингредиента на keep и удаляет дубли.
+
+        Строки меняются по одной через save() и delete(), чтобы сигналы
+        сдвинули суммы списков покупок и поисковые документы рецептов.
+        """
+        for item in models.IngredientInRecipe.objects.filter(
+                ingredient_id__in=duplicates
+        ).order_by("pk"):
+            kept = models.IngredientInRecipe.objects.filter(
+                recipe_id=item.recipe_id,
+                ingredient_id=keep
+            ).first()
+            if kept is None:
+                item.ingredient_id = keep
+                item.save()
+                continue
+            # в рецепте уже есть такой ингредиент - количества складываются
+            kept.amount += item.amount
+            kept.save()
+            item.delete()
+        models.Ingredient.objects.filter(pk__in=duplicates).delete()
+
+    def insert(self, ingredients, batch_size):
+        if ingredients:
+            models.Ingredient.objects.bulk_create(
+                ingredients,
+                batch_size=batch_size,
+                ignore_conflicts=True
+            )
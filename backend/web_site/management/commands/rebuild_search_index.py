@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from web_site import models, search
+
+
+class Command(BaseCommand):
+    help = "Пересобирает поисковые документы всех рецептов"
+
+    def handle(self, *args, **options):
+        search.create_structures()
+        search.update_documents()
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано рецептов: {models.Recipe.objects.count()}"
+        ))
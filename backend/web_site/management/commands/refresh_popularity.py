@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from web_site import popularity
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает рейтинг популярности рецептов для "
+        "?ordering=popular; запускается по расписанию"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--window",
+            action="append",
+            dest="windows",
+            help="Окно из POPULARITY_WINDOWS, по умолчанию все"
+        )
+
+    def handle(self, *args, **options):
+        windows = options["windows"]
+        unknown = set(windows or ()) - set(settings.POPULARITY_WINDOWS)
+        if unknown:
+            raise CommandError(
+                f"Неизвестные окна: {', '.join(sorted(unknown))}"
+            )
+        refreshed = popularity.refresh(windows)
+        for window, recipes in refreshed.items():
+            self.stdout.write(f"{window}: рецептов в рейтинге {recipes}")
+        self.stdout.write(self.style.SUCCESS("Рейтинг пересчитан"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from web_site import counters
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счетчики избранного, корзины, рецептов и подписчиков"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = counters.repair()
+        for counter, rows in fixed.items():
+            self.stdout.write(f"{counter}: исправлено строк {rows}")
+        self.stdout.write(self.style.SUCCESS("Счетчики пересчитаны"))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from web_site import shopping_totals
+
+
+class Command(BaseCommand):
+    help = "Сверяет и пересчитывает суммы ингредиентов списков покупок"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только сверить, ничего не меняя"
+        )
+
+    def handle(self, *args, **options):
+        if options["check"]:
+            mismatched = shopping_totals.check()
+            for user_id, ingredient_id in mismatched[:20]:
+                self.stdout.write(
+                    f"пользователь {user_id}, ингредиент {ingredient_id}"
+                )
+            if mismatched:
+                raise CommandError(
+                    f"Расходятся строк: {len(mismatched)}"
+                )
+            self.stdout.write(self.style.SUCCESS("Суммы сходятся"))
+            return
+        with transaction.atomic():
+            fixed = shopping_totals.repair()
+        for kind, rows in fixed.items():
+            self.stdout.write(f"{kind}: исправлено строк {rows}")
+        self.stdout.write(self.style.SUCCESS("Суммы пересчитаны"))
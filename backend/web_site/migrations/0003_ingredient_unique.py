@@ -0,0 +1,42 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Дубли (name, measurement_unit) сливаются в строку с меньшим id,
+    ссылки рецептов переводятся на нее"""
+    Ingredient = apps.get_model("web_site", "Ingredient")
+    IngredientInRecipe = apps.get_model("web_site", "IngredientInRecipe")
+    duplicates = Ingredient.objects.values(
+        "name",
+        "measurement_unit"
+    ).annotate(count=Count("id"), keep=Min("id")).filter(
+        count__gt=1
+    ).order_by()
+    for row in duplicates.iterator():
+        extra = Ingredient.objects.filter(
+            name=row["name"],
+            measurement_unit=row["measurement_unit"]
+        ).exclude(pk=row["keep"])
+        IngredientInRecipe.objects.filter(ingredient__in=extra).update(
+            ingredient_id=row["keep"]
+        )
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web_site', '0002_sync_model_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients,
+            migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_rows(apps, schema_editor):
+    """Повторы ингредиента в рецепте сливаются в строку с меньшим id,
+    количества складываются"""
+    IngredientInRecipe = apps.get_model("web_site", "IngredientInRecipe")
+    duplicates = IngredientInRecipe.objects.values(
+        "recipe_id",
+        "ingredient_id"
+    ).annotate(
+        count=Count("id"),
+        keep=Min("id"),
+        total=Sum("amount")
+    ).filter(count__gt=1).order_by()
+    for row in duplicates.iterator():
+        rows = IngredientInRecipe.objects.filter(
+            recipe_id=row["recipe_id"],
+            ingredient_id=row["ingredient_id"]
+        )
+        rows.exclude(pk=row["keep"]).delete()
+        rows.update(amount=row["total"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web_site', '0003_ingredient_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredientinrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_combination'),
+        ),
+    ]
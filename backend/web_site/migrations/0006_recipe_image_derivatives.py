@@ -0,0 +1,28 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web_site', '0005_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_card',
+            field=models.ImageField(blank=True, editable=False, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_full',
+            field=models.ImageField(blank=True, editable=False, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to=''),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+# istartswith на Postgres превращается в UPPER("name"::text) LIKE UPPER(...),
+# обычный индекс по name для такого условия не используется. Индексу
+# нужен text_pattern_ops, которого нет в SQLite, поэтому он создается
+# только на Postgres.
+INGREDIENT_PREFIX_INDEX = "ingredient_name_upper_prefix_idx"
+
+
+def create_ingredient_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {INGREDIENT_PREFIX_INDEX} "
+        'ON web_site_ingredient (UPPER("name"::text) text_pattern_ops)'
+    )
+
+
+def drop_ingredient_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INGREDIENT_PREFIX_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web_site', '0006_recipe_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['user', 'when_added'], name='favorite_user_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['user', 'when_added'], name='shoppingcart_user_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagsinrecipe',
+            index=models.Index(fields=['tag', 'recipe'], name='tagsinrecipe_tag_recipe_idx'),
+        ),
+        migrations.RunPython(
+            create_ingredient_prefix_index,
+            drop_ingredient_prefix_index
+        ),
+    ]
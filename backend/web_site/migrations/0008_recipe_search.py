@@ -0,0 +1,74 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:18
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+# SQL зафиксирован здесь: web_site.search может меняться после миграции
+INGREDIENT_NAMES_SQL = (
+    "SELECT {aggregate}(i.name, ' ') FROM web_site_ingredientinrecipe ir "
+    "JOIN web_site_ingredient i ON i.id = ir.ingredient_id "
+    "WHERE ir.recipe_id = r.id"
+)
+POSTGRES_SQL = (
+    "CREATE INDEX IF NOT EXISTS recipe_search_document_gin_idx "
+    "ON web_site_recipe USING gin (search_document)",
+    (
+        "UPDATE web_site_recipe r SET search_document = "
+        "setweight(to_tsvector(%(config)s, r.name), 'A') || "
+        "setweight(to_tsvector(%(config)s, coalesce(({names}), '')), 'B') || "
+        "setweight(to_tsvector(%(config)s, r.text), 'C')"
+    ).format(names=INGREDIENT_NAMES_SQL.format(aggregate="string_agg")),
+)
+SQLITE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS web_site_recipe_search USING fts5("
+    "name, ingredients, text, "
+    "tokenize = 'unicode61 remove_diacritics 2')",
+    "DELETE FROM web_site_recipe_search",
+    (
+        "INSERT INTO web_site_recipe_search (rowid, name, ingredients, text) "
+        "SELECT r.id, r.name, coalesce(({names}), ''), r.text "
+        "FROM web_site_recipe r"
+    ).format(names=INGREDIENT_NAMES_SQL.format(aggregate="group_concat")),
+)
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            params = {
+                "config": getattr(settings, "RECIPE_SEARCH_CONFIG", "russian")
+            }
+            for sql in POSTGRES_SQL:
+                cursor.execute(sql, params)
+        elif connection.vendor == "sqlite":
+            for sql in SQLITE_SQL:
+                cursor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "DROP INDEX IF EXISTS recipe_search_document_gin_idx"
+            )
+        elif connection.vendor == "sqlite":
+            cursor.execute("DROP TABLE IF EXISTS web_site_recipe_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web_site', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_document',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
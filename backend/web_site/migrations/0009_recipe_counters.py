@@ -0,0 +1,55 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:21
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# (что считаем, поле связи, у кого счетчик, поле счетчика)
+COUNTERS = (
+    ("web_site.Favorite", "recipe_id", "web_site.Recipe", "favorites_count"),
+    (
+        "web_site.ShoppingCart",
+        "recipe_id",
+        "web_site.Recipe",
+        "shopping_cart_count"
+    ),
+    ("web_site.Recipe", "author_id", "users.User", "recipes_count"),
+    ("users.Follow", "following_id", "users.User", "followers_count"),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for source, field, target, counter in COUNTERS:
+        actual = Coalesce(
+            Subquery(
+                apps.get_model(source).objects.filter(
+                    **{field: OuterRef("pk")}
+                ).order_by().values(field).annotate(
+                    total=Count("pk")
+                ).values("total")
+            ),
+            0
+        )
+        apps.get_model(target).objects.update(**{counter: actual})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_counters'),
+        ('web_site', '0008_recipe_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
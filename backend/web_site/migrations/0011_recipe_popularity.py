@@ -0,0 +1,33 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web_site', '0010_shopping_list_items'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipePopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(max_length=32, verbose_name='Окно')),
+                ('score', models.FloatField(verbose_name='Вес')),
+                ('rank', models.PositiveIntegerField(verbose_name='Место')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='popularity', to='web_site.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Популярность рецепта',
+                'verbose_name_plural': 'Популярность рецептов',
+                'indexes': [models.Index(fields=['window', 'rank'], name='popularity_window_rank_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='recipepopularity',
+            constraint=models.UniqueConstraint(fields=('window', 'recipe'), name='unique_recipe_popularity'),
+        ),
+    ]
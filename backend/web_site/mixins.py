@@ -0,0 +1,188 @@
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from . import versions
+
+
+def make_validators(parts, last_modified):
+    """ETag из частей валидатора и Last-Modified в целых секундах"""
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    # слабый ETag: он описывает данные, а не байты (ответ может быть сжат)
+    etag = "W/" + quote_etag(digest)
+    if last_modified is not None:
+        last_modified = math.ceil(last_modified)
+    return etag, last_modified
+
+
+def normalized_params(query_params):
+    """Параметры запроса в порядке, не зависящем от их порядка в url"""
+    return sorted(
+        (key, sorted(query_params.getlist(key))) for key in query_params
+    )
+
+
+def set_validators(response, etag, last_modified, per_user):
+    if response.status_code in (200, 304):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+    if per_user:
+        patch_vary_headers(response, ("Authorization",))
+
+
+class ConditionalGetMixin:
+    """ETag и Last-Modified для list и retrieve без рендеринга ответа.
+
+    get_list_validators и get_detail_validators возвращают пару
+    (части ETag, время изменения в секундах или None) либо None, если
+    валидаторы посчитать нельзя. При совпадении с If-None-Match или
+    If-Modified-Since клиент получает 304, а сериализация не выполняется.
+    """
+    # ответ зависит от пользователя: избранное, корзина, подписки
+    conditional_per_user = False
+
+    def get_list_validators(self):
+        return None
+
+    def get_detail_validators(self):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_list_validators(),
+            super().list,
+            request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_detail_validators(),
+            super().retrieve,
+            request, *args, **kwargs
+        )
+
+    def conditional_response(self, validators, handler, request,
+                             *args, **kwargs):
+        if validators is None:
+            return handler(request, *args, **kwargs)
+        parts, last_modified = validators
+        if self.conditional_per_user and request.user.is_authenticated:
+            state = versions.get_version(
+                versions.user_state(request.user.id)
+            )
+            parts = (*parts, request.user.id, state)
+            if last_modified is not None:
+                last_modified = max(last_modified, state)
+        etag, last_modified = make_validators(parts, last_modified)
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        set_validators(
+            response,
+            etag,
+            last_modified,
+            self.conditional_per_user
+        )
+        return response
+
+
+class AnonymousCacheMixin:
+    """Кэш отрендеренных ответов list и retrieve для анонимных запросов.
+
+    Ключ - схема и хост, имя view, действие, pk и нормализованные
+    параметры запроса; кэшируются только json-ответы. Вместе с ответом
+    хранятся версии данных из get_cache_versions: если сигналы сменили
+    версию, запись устарела. С RESPONSE_CACHE_SERVE_STALE устаревшую
+    запись отдают, пока один запрос пересчитывает ее под блокировкой,
+    а при пустом ключе остальные запросы недолго ждут, пока ответ
+    посчитает первый.
+    """
+    cache_status_header = "X-Response-Cache"
+
+    def get_cache_versions(self):
+        return ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve,
+            request, *args, **kwargs
+        )
+
+    def get_response_cache_key(self, request):
+        # в ответе абсолютные ссылки (фото, next/previous) - нужен и адрес
+        raw = repr((
+            request.scheme,
+            request.get_host(),
+            self.basename,
+            self.action,
+            self.kwargs.get(self.lookup_url_kwarg or self.lookup_field),
+            normalized_params(request.query_params)
+        ))
+        return "web_site:response:" + hashlib.md5(raw.encode()).hexdigest()
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        # html браузерного API содержит csrf-токен, его не кэшируем
+        if (not request.user.is_anonymous
+                or request.accepted_renderer.format != "json"):
+            return handler(request, *args, **kwargs)
+        cache = caches[settings.RESPONSE_CACHE_ALIAS]
+        key = self.get_response_cache_key(request)
+        lock_key = key + ":lock"
+        current = versions.get_versions(*self.get_cache_versions())
+        current = sorted(current.items())
+
+        entry = cache.get(key)
+        if entry is not None and entry["versions"] == current:
+            return self.response_from_entry(entry, "HIT")
+
+        if not cache.add(lock_key, 1, settings.RESPONSE_CACHE_LOCK_TIMEOUT):
+            # ответ уже пересчитывает другой запрос
+            if entry is not None and settings.RESPONSE_CACHE_SERVE_STALE:
+                return self.response_from_entry(entry, "STALE")
+            if entry is None:
+                deadline = time.monotonic() + settings.RESPONSE_CACHE_WAIT
+                while time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    entry = cache.get(key)
+                    if entry is not None and entry["versions"] == current:
+                        return self.response_from_entry(entry, "HIT")
+            return handler(request, *args, **kwargs)
+
+        try:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response = self.finalize_response(request, response)
+            response.render()
+            entry = {
+                "versions": current,
+                "content": response.content,
+                "content_type": response["Content-Type"],
+            }
+            cache.set(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+            return self.response_from_entry(entry, "MISS")
+        finally:
+            cache.delete(lock_key)
+
+    def response_from_entry(self, entry, status):
+        response = HttpResponse(
+            entry["content"],
+            content_type=entry["content_type"]
+        )
+        response[self.cache_status_header] = status
+        patch_vary_headers(response, ("Accept",))
+        return response
@@ -1,6 +1,10 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import Exists, OuterRef, Prefetch
+
+from foodgram.db.counters import CountersMixin
 
 User = get_user_model()
 
@@ -56,12 +60,57 @@ class Ingredient(models.Model):
         ordering = ['name']
         verbose_name = "Ингредиент"
         verbose_name_plural = "Ингредиенты"
+        constraints = [
+            models.UniqueConstraint(
+                fields=[
+                    'name',
+                    'measurement_unit'
+                ],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return f"{self.name}, {self.measurement_unit}"
 
 
-class Recipe(models.Model):
+def related_lookups():
+    """Теги и ингредиенты рецепта для prefetch_related"""
+    return [
+        "tags",
+        Prefetch(
+            "recipes",
+            queryset=IngredientInRecipe.objects.select_related("ingredient")
+        )
+    ]
+
+
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self):
+        """Автор, теги и ингредиенты одним фиксированным набором запросов"""
+        return self.select_related("author").prefetch_related(
+            *related_lookups()
+        )
+
+    def with_user_flags(self, user):
+        """Флаги избранного, корзины и подписки на автора для user"""
+        if user is None or user.is_anonymous:
+            return self
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef("pk"))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef("pk"))
+            ),
+            is_subscribed_to_author=Exists(
+                user.follower.filter(following=OuterRef("author"))
+            )
+        )
+
+
+class Recipe(CountersMixin, models.Model):
     author = models.ForeignKey(
         User,
         verbose_name="Автор рецепта",
@@ -73,6 +122,10 @@ class Recipe(models.Model):
         max_length=250
     )
     image = models.ImageField()
+    # уменьшенные копии image, их делает web_site.images после сохранения
+    image_thumbnail = models.ImageField(blank=True, editable=False)
+    image_card = models.ImageField(blank=True, editable=False)
+    image_full = models.ImageField(blank=True, editable=False)
     text = models.TextField(verbose_name="Текстовое описание")
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -96,17 +149,41 @@ class Recipe(models.Model):
         verbose_name="Время публикации",
         editable=False
     )
+    # документ полнотекстового поиска (Postgres), его ведет web_site.search
+    search_document = SearchVectorField(null=True, editable=False)
+    # счетчики ведет web_site.counters
+    favorites_count = models.PositiveIntegerField(
+        verbose_name="В избранном",
+        default=0,
+        editable=False
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name="В списках покупок",
+        default=0,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    counter_fields = ("favorites_count", "shopping_cart_count")
 
     class Meta:
         ordering = ["-pub_date"]
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
+        indexes = [
+            # лента и keyset-пагинация идут по (pub_date, id) по убыванию
+            models.Index(
+                fields=["-pub_date", "-id"],
+                name="recipe_pub_date_id_idx"
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class IngredientInRecipe(models.Model):
+class IngredientInRecipe(CountersMixin, models.Model):
     ingredient = models.ForeignKey(
         Ingredient,
         verbose_name='ингредиент',
@@ -158,9 +235,16 @@ class TagsInRecipe(models.Model):
 
     class Meta:
         verbose_name_plural = verbose_name = "Тэги в рецепте"
+        indexes = [
+            # фильтр ленты по тегу идет от тега к рецептам
+            models.Index(
+                fields=["tag", "recipe"],
+                name="tagsinrecipe_tag_recipe_idx"
+            ),
+        ]
 
 
-class Favorite(models.Model):
+class Favorite(CountersMixin, models.Model):
     user = models.ForeignKey(
         User,
         verbose_name="Пользователь",
@@ -184,12 +268,18 @@ class Favorite(models.Model):
             "user",
             "recipe"
         )
+        indexes = [
+            models.Index(
+                fields=["user", "when_added"],
+                name="favorite_user_added_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user} added {self.recipe}"
 
 
-class ShoppingCart(models.Model):
+class ShoppingCart(CountersMixin, models.Model):
     recipe = models.ForeignKey(
         Recipe,
         verbose_name="Рецепт в списке покупок",
@@ -214,6 +304,83 @@ class ShoppingCart(models.Model):
             "user",
             "recipe"
         )
+        indexes = [
+            models.Index(
+                fields=["user", "when_added"],
+                name="shoppingcart_user_added_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user} added {self.recipe}"
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента по всем рецептам корзины пользователя.
+
+    Ведет web_site.shopping_totals в тех же транзакциях, что меняют
+    корзину и ингредиенты рецептов; сверяет и чинит - repair_shopping_lists.
+    """
+    user = models.ForeignKey(
+        User,
+        verbose_name="Пользователь",
+        related_name="shopping_list",
+        on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name="Ингредиент",
+        related_name="+",
+        on_delete=models.CASCADE
+    )
+    # не Positive: промежуточные значения при вычитании бывают <= 0
+    amount = models.IntegerField(verbose_name="Количество", default=0)
+
+    class Meta:
+        verbose_name = "Ингредиент списка покупок"
+        verbose_name_plural = "Ингредиенты списков покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_shopping_list_item"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.ingredient} - {self.amount}"
+
+
+class RecipePopularity(models.Model):
+    """Место рецепта в рейтинге популярности за окно window.
+
+    Таблицу целиком пересчитывает web_site.popularity (команда
+    refresh_popularity), рецепты без событий в окне в ней не хранятся.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name="Рецепт",
+        related_name="popularity",
+        on_delete=models.CASCADE
+    )
+    window = models.CharField(verbose_name="Окно", max_length=32)
+    score = models.FloatField(verbose_name="Вес")
+    rank = models.PositiveIntegerField(verbose_name="Место")
+
+    class Meta:
+        verbose_name = "Популярность рецепта"
+        verbose_name_plural = "Популярность рецептов"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["window", "recipe"],
+                name="unique_recipe_popularity"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["window", "rank"],
+                name="popularity_window_rank_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.window}: {self.rank}. {self.recipe_id}"
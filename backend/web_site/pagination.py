@@ -0,0 +1,120 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.core.paginator import InvalidPage, Paginator
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class RecipeCursorPagination(BasePagination):
+    """Keyset-пагинация ленты рецептов по (pub_date, id).
+
+    Следующая страница выбирается условием
+    (pub_date, id) < (pub_date, id) последнего рецепта, поэтому стоимость
+    не зависит от глубины прокрутки, а COUNT(*) не выполняется вовсе.
+    Включается параметром ?cursor= (для первой страницы - пустым).
+    """
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    max_page_size = 100
+    ordering = ("-pub_date", "-id")
+    invalid_cursor_message = "Неверный курсор."
+
+    @classmethod
+    def requested(cls, request):
+        return cls.cursor_query_param in request.query_params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, recipe):
+        raw = f"{recipe.pub_date.isoformat()}|{recipe.pk}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, value):
+        try:
+            raw = base64.urlsafe_b64decode(value.encode()).decode()
+            pub_date, pk = raw.split("|")
+            return datetime.fromisoformat(pub_date), int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            pub_date, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk)
+            )
+        # лишняя строка показывает, есть ли следующая страница
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, page):
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        queryset = self.get_page_queryset(queryset, request)
+        return self.set_page([obj async for obj in queryset])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    """PageNumberPagination для async-view: COUNT и страница через async ORM"""
+
+    async def apaginate_queryset(self, queryset, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        # номера страниц считает Paginator по числу строк, без запроса
+        paginator = Paginator(range(await queryset.acount()), page_size)
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number,
+                message=str(exc)
+            ))
+        bottom = (self.page.number - 1) * page_size
+        top = bottom + len(self.page.object_list)
+        self.page.object_list = [obj async for obj in queryset[bottom:top]]
+        return list(self.page)
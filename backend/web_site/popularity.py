@@ -0,0 +1,162 @@
+"""Рейтинг популярности рецептов для ?ordering=popular.
+
+Считать популярность на лету - это GROUP BY по избранному и корзинам на
+каждый запрос ленты, поэтому рейтинг хранится готовым в RecipePopularity
+и пересчитывается командой refresh_popularity (по расписанию, например
+раз в несколько минут). Вес рецепта в окне - сумма событий добавления
+в избранное и в корзину за последние days дней, где каждое событие
+весит 0.5 ** (возраст в часах / half_life_hours). События считаются
+в бд с точностью до часа, затухание - здесь. Окна задает
+POPULARITY_WINDOWS, лента читает только готовые места.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from . import models, versions
+
+# откуда берутся события и сколько весит каждое
+SOURCES = (
+    (models.Favorite, 1.0),
+    (models.ShoppingCart, 1.0),
+)
+
+
+def requested(params):
+    return params.get("ordering") == "popular"
+
+
+def window_name(params):
+    window = params.get("window") or settings.POPULARITY_DEFAULT_WINDOW
+    if window not in settings.POPULARITY_WINDOWS:
+        raise ValidationError({"window": [
+            f"Допустимые значения: {', '.join(settings.POPULARITY_WINDOWS)}."
+        ]})
+    return window
+
+
+class RankedRecipes:
+    """Рецепты queryset в порядке рейтинга окна для пагинации по номерам.
+
+    Сначала идут рецепты с местом в окне - JOIN с RecipePopularity по
+    индексу (window, rank), за ними остальные по (pub_date, id), тоже по
+    индексу; страница на стыке берется из обеих частей. Сортировки всей
+    таблицы и подзапроса на каждый рецепт нет. Поддерживает то, что нужно
+    Paginator и AsyncPageNumberPagination: count(), acount() и срез,
+    который перебирается и обычным, и асинхронным for.
+    """
+
+    def __init__(self, queryset, window):
+        self.ranked = queryset.filter(popularity__window=window).order_by(
+            "popularity__rank"
+        )
+        self.rest = queryset.exclude(Exists(
+            models.RecipePopularity.objects.filter(
+                recipe=OuterRef("pk"),
+                window=window
+            )
+        )).order_by("-pub_date", "-id")
+        self.ranked_count = None
+
+    def count(self):
+        self.ranked_count = self.ranked.count()
+        return self.ranked_count + self.rest.count()
+
+    async def acount(self):
+        self.ranked_count = await self.ranked.acount()
+        return self.ranked_count + await self.rest.acount()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError("RankedRecipes поддерживает только срезы")
+        if self.ranked_count is None:
+            self.count()
+        start, stop, split = item.start or 0, item.stop, self.ranked_count
+        parts = []
+        if start < split:
+            parts.append(self.ranked[start:min(stop, split)])
+        if stop > split:
+            parts.append(self.rest[max(start - split, 0):stop - split])
+        return RankedPage(parts)
+
+
+class RankedPage:
+    """Срез RankedRecipes: части по очереди"""
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.items = None
+
+    def load(self):
+        if self.items is None:
+            self.items = [recipe for part in self.parts for recipe in part]
+        return self.items
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    async def __aiter__(self):
+        for part in self.parts:
+            async for recipe in part:
+                yield recipe
+
+
+def ranked(queryset, params):
+    return RankedRecipes(queryset, window_name(params))
+
+
+def scores(days, half_life_hours, now):
+    """{recipe_id: вес} по событиям за days дней до now"""
+    result = defaultdict(float)
+    for model, weight in SOURCES:
+        rows = model.objects.filter(
+            when_added__gte=now - timedelta(days=days)
+        ).values(
+            "recipe_id",
+            hour=TruncHour("when_added")
+        ).annotate(events=Count("pk")).order_by()
+        for row in rows.iterator():
+            decay = 1.0
+            if half_life_hours:
+                age = (now - row["hour"]).total_seconds() / 3600
+                decay = 0.5 ** (max(age, 0) / half_life_hours)
+            result[row["recipe_id"]] += weight * row["events"] * decay
+    return result
+
+
+def refresh(windows=None, now=None):
+    """Пересчитывает рейтинг окон, возвращает {окно: число рецептов}"""
+    now = now or timezone.now()
+    refreshed = {}
+    for window in windows or settings.POPULARITY_WINDOWS:
+        options = settings.POPULARITY_WINDOWS[window]
+        ranked = sorted(
+            scores(options["days"], options["half_life_hours"], now).items(),
+            key=lambda item: (-item[1], -item[0])
+        )
+        with transaction.atomic():
+            models.RecipePopularity.objects.filter(window=window).delete()
+            models.RecipePopularity.objects.bulk_create(
+                (
+                    models.RecipePopularity(
+                        recipe_id=recipe_id,
+                        window=window,
+                        score=score,
+                        rank=rank
+                    )
+                    for rank, (recipe_id, score) in enumerate(ranked, 1)
+                ),
+                batch_size=1000
+            )
+        refreshed[window] = len(ranked)
+    versions.bump_version(versions.POPULARITY)
+    return refreshed
@@ -0,0 +1,111 @@
+"""Избранное и корзина: добавление и удаление рецептов одним запросом.
+
+INSERT ... ON CONFLICT DO NOTHING RETURNING и DELETE ... RETURNING сразу
+сообщают, какие строки изменились, поэтому не нужны ни exists() перед
+записью, ни загрузка рецептов, а двойное нажатие не падает на
+unique_together. Несуществующие рецепты отсеивает сам INSERT ... SELECT.
+Сигналы моделей при этом не срабатывают: счетчики рецептов и суммы
+списка покупок обновляются здесь же (на Postgres - в том же запросе),
+версия состояния пользователя - после него.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import counters, models, shopping_totals, versions
+
+# сколько рецептов можно передать в одном массовом запросе
+BULK_LIMIT = 100
+
+
+def returning(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def execute(model, user_id, statement, params, delta):
+    """Выполняет INSERT/DELETE ... RETURNING recipe_id и сдвигает счетчики
+    рецептов на delta; на Postgres - одним запросом через WITH"""
+    quote = connection.ops.quote_name
+    targets = counters.counted_by(model)
+    totals = model is models.ShoppingCart
+    if connection.vendor == "postgresql":
+        updates = "".join(
+            f", counted_{number} AS (UPDATE {quote(target._meta.db_table)} "
+            f"SET {quote(counter)} = {quote(counter)} + {int(delta)} "
+            "WHERE id IN (SELECT recipe_id FROM changed))"
+            for number, (_, target, counter) in enumerate(targets)
+        )
+        if totals:
+            totals_statement = shopping_totals.cart_statement(
+                user_id, delta, "SELECT recipe_id FROM changed"
+            )
+            updates += f", totals AS ({totals_statement})"
+        with transaction.atomic():
+            recipe_ids = returning(
+                f"WITH changed AS ({statement}){updates} "
+                "SELECT recipe_id FROM changed",
+                params
+            )
+            # строки с нулевой суммой в том же запросе не удалить: WITH
+            # видит таблицу до INSERT ... ON CONFLICT из totals
+            if totals and delta < 0 and recipe_ids:
+                shopping_totals.drop_empty(user_id=user_id)
+    else:
+        with transaction.atomic():
+            recipe_ids = returning(statement, params)
+            for _, target, counter in targets:
+                counters.add(target, counter, recipe_ids, delta)
+            if totals:
+                shopping_totals.cart_changed(user_id, recipe_ids, delta)
+    if recipe_ids:
+        versions.bump_version_on_commit(
+            versions.user_state(user_id)
+        )
+    return recipe_ids
+
+
+def add(model, user_id, recipe_ids):
+    """Добавляет рецепты в список, возвращает id добавленных сейчас"""
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    if not recipe_ids:
+        return []
+    quote = connection.ops.quote_name
+    placeholders = ", ".join(["%s"] * len(recipe_ids))
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    # WHERE перед ON CONFLICT обязателен для INSERT ... SELECT в SQLite
+    return execute(
+        model,
+        user_id,
+        f"INSERT INTO {quote(model._meta.db_table)} "
+        "(user_id, recipe_id, when_added) "
+        f"SELECT %s, id, %s FROM {quote(models.Recipe._meta.db_table)} "
+        f"WHERE id IN ({placeholders}) "
+        "ON CONFLICT (user_id, recipe_id) DO NOTHING RETURNING recipe_id",
+        [user_id, now, *recipe_ids],
+        1
+    )
+
+
+def remove(model, user_id, recipe_ids):
+    """Убирает рецепты из списка, возвращает id убранных сейчас"""
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    if not recipe_ids:
+        return []
+    placeholders = ", ".join(["%s"] * len(recipe_ids))
+    return execute(
+        model,
+        user_id,
+        "DELETE FROM "
+        f"{connection.ops.quote_name(model._meta.db_table)} "
+        f"WHERE user_id = %s AND recipe_id IN ({placeholders}) "
+        "RETURNING recipe_id",
+        [user_id, *recipe_ids],
+        -1
+    )
+
+
+def existing(recipe_ids):
+    return set(models.Recipe.objects.filter(
+        pk__in=recipe_ids
+    ).order_by().values_list("pk", flat=True))
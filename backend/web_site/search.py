@@ -0,0 +1,157 @@
+"""Полнотекстовый поиск рецептов по названию, описанию и ингредиентам.
+
+На Postgres документ хранится в Recipe.search_document (tsvector под
+GIN-индексом), на SQLite - в отдельной таблице FTS5. В обоих случаях
+документ пересчитывается одним запросом для измененных рецептов после
+коммита транзакции (сигналы в signals.py), поэтому поиск не собирает
+текст рецептов на лету.
+"""
+import re
+from functools import partial
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+from . import models
+
+CONFIG = getattr(settings, "RECIPE_SEARCH_CONFIG", "russian")
+FTS_TABLE = "web_site_recipe_search"
+GIN_INDEX = "recipe_search_document_gin_idx"
+
+# название важнее ингредиентов, ингредиенты важнее описания
+INGREDIENT_NAMES_SQL = (
+    "SELECT {aggregate}(i.name, ' ') FROM web_site_ingredientinrecipe ir "
+    "JOIN web_site_ingredient i ON i.id = ir.ingredient_id "
+    "WHERE ir.recipe_id = r.id"
+)
+POSTGRES_UPDATE_SQL = (
+    "UPDATE web_site_recipe r SET search_document = "
+    "setweight(to_tsvector(%(config)s, r.name), 'A') || "
+    "setweight(to_tsvector(%(config)s, coalesce(({names}), '')), 'B') || "
+    "setweight(to_tsvector(%(config)s, r.text), 'C')"
+).format(names=INGREDIENT_NAMES_SQL.format(aggregate="string_agg"))
+SQLITE_INSERT_SQL = (
+    f"INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) "
+    "SELECT r.id, r.name, coalesce(({names}), ''), r.text "
+    "FROM web_site_recipe r"
+).format(names=INGREDIENT_NAMES_SQL.format(aggregate="group_concat"))
+
+
+def create_structures(using=connection):
+    if using.vendor == "postgresql":
+        with using.cursor() as cursor:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {GIN_INDEX} "
+                "ON web_site_recipe USING gin (search_document)"
+            )
+    elif using.vendor == "sqlite":
+        with using.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                "name, ingredients, text, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+
+
+def drop_structures(using=connection):
+    with using.cursor() as cursor:
+        if using.vendor == "postgresql":
+            cursor.execute(f"DROP INDEX IF EXISTS {GIN_INDEX}")
+        elif using.vendor == "sqlite":
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def update_documents(recipe_ids=None, using=connection):
+    """Пересчитывает документы рецептов (всех, если recipe_ids не задан)"""
+    if recipe_ids is not None:
+        recipe_ids = [int(pk) for pk in recipe_ids]
+        if not recipe_ids:
+            return
+    with using.cursor() as cursor:
+        if using.vendor == "postgresql":
+            sql, params = POSTGRES_UPDATE_SQL, {"config": CONFIG}
+            if recipe_ids is not None:
+                sql += " WHERE r.id = ANY(%(ids)s)"
+                params["ids"] = recipe_ids
+            cursor.execute(sql, params)
+        elif using.vendor == "sqlite":
+            if recipe_ids is None:
+                cursor.execute(f"DELETE FROM {FTS_TABLE}")
+                cursor.execute(SQLITE_INSERT_SQL)
+                return
+            placeholders = ", ".join(["%s"] * len(recipe_ids))
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})",
+                recipe_ids
+            )
+            cursor.execute(
+                f"{SQLITE_INSERT_SQL} WHERE r.id IN ({placeholders})",
+                recipe_ids
+            )
+
+
+def schedule_update(recipe_ids):
+    """Документы пересчитываются, когда все изменения рецепта уже в бд"""
+    transaction.on_commit(partial(update_documents, list(recipe_ids)))
+
+
+def delete_documents(recipe_ids):
+    # на Postgres документ удаляется вместе со строкой рецепта
+    if connection.vendor != "sqlite":
+        return
+    recipe_ids = [int(pk) for pk in recipe_ids]
+    placeholders = ", ".join(["%s"] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})",
+            recipe_ids
+        )
+
+
+def fts_match(query):
+    """Запрос FTS5: все слова, каждое как префикс, без операторов FTS5"""
+    words = re.findall(r"\w+", query)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def requested(params):
+    return bool(params.get("search", "").strip())
+
+
+def search(queryset, query):
+    """Оставляет рецепты, подходящие под query, и сортирует по релевантности"""
+    if connection.vendor == "postgresql":
+        search_query = SearchQuery(
+            query,
+            config=CONFIG,
+            search_type="websearch"
+        )
+        queryset = queryset.filter(search_document=search_query).annotate(
+            search_rank=SearchRank(F("search_document"), search_query)
+        )
+    elif connection.vendor == "sqlite":
+        match = fts_match(query)
+        if not match:
+            return queryset.none()
+        # bm25 тем меньше, чем лучше совпадение; веса - name, ingredients, text
+        queryset = queryset.filter(
+            pk__in=RawSQL(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                (match,)
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT -bm25({FTS_TABLE}, 10.0, 4.0, 1.0) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s "
+                f"AND {FTS_TABLE}.rowid = {models.Recipe._meta.db_table}.id",
+                (match,)
+            )
+        )
+    else:
+        queryset = queryset.filter(name__icontains=query).annotate(
+            search_rank=RawSQL("0", ())
+        )
+    return queryset.order_by("-search_rank", "-pub_date", "-id")
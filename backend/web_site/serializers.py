@@ -1,12 +1,15 @@
 from django.db import transaction
+from django.db.models import Manager, prefetch_related_objects
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
+from foodgram.metrics import TimedSerializerMixin
 from users.serializers import UserSerializer
-from . import models
+from . import fragments, images, models, shopping_totals, viewer_state
+from .recipe_lists import BULK_LIMIT
 
 
-class TagSerializers(serializers.ModelSerializer):
+class TagSerializers(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Tag
         fields = (
@@ -38,7 +41,7 @@ class IngredientInRecipeSerializers(serializers.ModelSerializer):
         )
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Ingredient
         fields = (
@@ -48,14 +51,75 @@ class IngredientSerializer(serializers.ModelSerializer):
         )
 
 
-class ShowRecipeSerializer(serializers.ModelSerializer):
+class RecipeAuthorSerializer(UserSerializer):
+    """Автор без флага подписки: он зависит от пользователя"""
+    is_subscribed = None
+
+    class Meta(UserSerializer.Meta):
+        fields = (
+            "id",
+            "username",
+            "email",
+            "first_name",
+            "last_name",
+        )
+
+
+class RecipeFragmentSerializer(TimedSerializerMixin,
+                               serializers.ModelSerializer):
+    """Часть рецепта, одинаковая для всех пользователей (fragments.py)"""
     tags = TagSerializers(
         read_only=True,
         many=True
     )
-    image = Base64ImageField()
-    author = UserSerializer(read_only=True)
+    # размер копии фото: card в списках, full для одного рецепта
+    image = serializers.SerializerMethodField("get_image")
+    author = RecipeAuthorSerializer(read_only=True)
     ingredients = serializers.SerializerMethodField("get_ingredients")
+
+    class Meta:
+        model = models.Recipe
+        fields = (
+            "id",
+            "tags",
+            "author",
+            "ingredients",
+            "name",
+            "image",
+            "text",
+            "cooking_time"
+        )
+
+    def get_image(self, obj):
+        return images.derivative_url(
+            obj,
+            self.context.get("image_size", "card"),
+            self.context.get("request")
+        )
+
+    def get_ingredients(self, obj):
+        # obj.recipes - строки IngredientInRecipe, обычно уже prefetch-нутые
+        return IngredientInRecipeSerializers(obj.recipes.all(), many=True).data
+
+
+class ShowRecipeListSerializer(TimedSerializerMixin,
+                               serializers.ListSerializer):
+
+    def to_representation(self, data):
+        # фрагменты всей страницы - одним запросом к кэшу
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        state = viewer_state.get(self.context)
+        if state is not None:
+            state.expect(
+                recipe_ids=[recipe.pk for recipe in recipes],
+                author_ids=[recipe.author_id for recipe in recipes]
+            )
+        return self.child.represent(recipes)
+
+
+class ShowRecipeSerializer(RecipeFragmentSerializer):
+    """Фрагмент рецепта из кэша и флаги пользователя поверх него"""
+    author = UserSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField("get_is_favorite")
     is_in_shopping_cart = serializers.SerializerMethodField("get_is_in_shopping_cart")
 
@@ -73,27 +137,70 @@ class ShowRecipeSerializer(serializers.ModelSerializer):
             "text",
             "cooking_time"
         )
+        list_serializer_class = ShowRecipeListSerializer
 
-    def get_ingredients(self, obj):
-        ingredients = models.IngredientInRecipe.objects.filter(recipe=obj)
-        return IngredientInRecipeSerializers(ingredients, many=True).data
+    def to_representation(self, instance):
+        return self.represent([instance])[0]
+
+    def represent(self, recipes):
+        data = fragments.cached(recipes, self.context, self.render_fragments)
+        return [
+            self.add_flags(recipe, fragment)
+            for recipe, fragment in zip(recipes, data)
+        ]
+
+    def render_fragments(self, recipes):
+        # связи нужны только рецептам, которых нет в кэше
+        prefetch_related_objects(
+            recipes,
+            "author",
+            *models.related_lookups()
+        )
+        return RecipeFragmentSerializer(
+            recipes,
+            many=True,
+            context=self.context
+        ).data
+
+    def add_flags(self, recipe, fragment):
+        flags = {
+            "is_favorited": self.get_is_favorite(recipe),
+            "is_in_shopping_cart": self.get_is_in_shopping_cart(recipe),
+        }
+        data = {
+            field: flags[field] if field in flags else fragment[field]
+            for field in self.Meta.fields
+        }
+        data["author"] = {
+            **fragment["author"],
+            "is_subscribed": self.get_is_subscribed_to_author(recipe)
+        }
+        return data
 
     def get_is_favorite(self, obj):
-        request = self.context.get("request")
-        if request is None or request.user.is_anonymous:
+        state = viewer_state.get(self.context)
+        if state is None:
             return False
-        user = request.user
-        return models.Favorite.objects.filter(recipe=obj, user=user).exists()
+        if hasattr(obj, "is_favorited"):
+            return obj.is_favorited
+        return state.is_favorited(obj.pk)
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get("request")
-        if request is None or request.user.is_anonymous:
+        state = viewer_state.get(self.context)
+        if state is None:
             return False
-        user = request.user
-        return models.ShoppingCart.objects.filter(
-            recipe=obj,
-            user=user
-        ).exists()
+        if hasattr(obj, "is_in_shopping_cart"):
+            return obj.is_in_shopping_cart
+        return state.is_in_shopping_cart(obj.pk)
+
+    def get_is_subscribed_to_author(self, obj):
+        # автора не загружаем: нужен только author_id
+        state = viewer_state.get(self.context)
+        if state is None:
+            return False
+        if hasattr(obj, "is_subscribed_to_author"):
+            return obj.is_subscribed_to_author
+        return state.is_subscribed(obj.author_id)
 
 
 class AddIngredientToRecipeSerializers(serializers.ModelSerializer):
@@ -138,31 +245,111 @@ class CreateRecipeSerializers(serializers.ModelSerializer):
         )
 
     def validate(self, obj):
+        # при PATCH проверяем только переданные поля
         for field in ['name', 'text', 'cooking_time']:
+            if self.partial and field not in obj:
+                continue
             if not obj.get(field):
                 raise serializers.ValidationError(f'{field} - Обязательное поле.')
-        if not obj.get('tags'):
+        if (not self.partial or 'tags' in obj) and not obj.get('tags'):
             raise serializers.ValidationError('Нужно указать минимум 1 тег.')
+        tags = obj.get('tags') or []
+        if len(tags) != len(set(tags)):
+            raise serializers.ValidationError('Теги должны быть уникальны.')
+        if self.partial and 'ingredients' not in obj:
+            return obj
         if not obj.get('ingredients'):
             raise serializers.ValidationError('Нужно указать минимум 1 ингредиент.')
         inrgedient_id_list = [item['id'] for item in obj.get('ingredients')]
         unique_ingredient_id_list = set(inrgedient_id_list)
         if len(inrgedient_id_list) != len(unique_ingredient_id_list):
             raise serializers.ValidationError('Ингредиенты должны быть уникальны.')
+        # все id ингредиентов проверяются одним запросом
+        found = models.Ingredient.objects.only("id").in_bulk(
+            unique_ingredient_id_list
+        )
+        missing = sorted(unique_ingredient_id_list - set(found))
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {missing}'
+            )
         return obj
 
     @transaction.atomic
     def tags_and_ingredients_set(self, recipe, tags, ingredients):
-        recipe.tags.set(tags)
-        for ingredient in ingredients:
-            ingredient_id = ingredient['id']
-            amount = ingredient['amount']
-            # Создаем запись в модели IngredientInRecipe
-            models.IngredientInRecipe.objects.create(
+        models.TagsInRecipe.objects.bulk_create(
+            models.TagsInRecipe(recipe=recipe, tag=tag) for tag in tags
+        )
+        models.IngredientInRecipe.objects.bulk_create(
+            models.IngredientInRecipe(
+                recipe=recipe,
+                ingredient_id=ingredient['id'],
+                amount=ingredient['amount']
+            )
+            for ingredient in ingredients
+        )
+
+    def update_tags(self, recipe, tags):
+        """Добавляет и удаляет только изменившиеся теги"""
+        current = set(
+            models.TagsInRecipe.objects.filter(
+                recipe=recipe
+            ).values_list('tag_id', flat=True)
+        )
+        new = {tag.id for tag in tags}
+        if current - new:
+            models.TagsInRecipe.objects.filter(
+                recipe=recipe,
+                tag_id__in=current - new
+            ).delete()
+        if new - current:
+            models.TagsInRecipe.objects.bulk_create(
+                models.TagsInRecipe(recipe=recipe, tag_id=tag_id)
+                for tag_id in new - current
+            )
+
+    def update_ingredients(self, recipe, ingredients):
+        """Добавляет, удаляет и меняет количество только там, где нужно"""
+        current = {
+            row.ingredient_id: row
+            for row in models.IngredientInRecipe.objects.filter(
+                recipe=recipe
+            ).only('id', 'ingredient_id', 'amount')
+        }
+        new = {item['id']: item['amount'] for item in ingredients}
+        removed = current.keys() - new.keys()
+        if removed:
+            models.IngredientInRecipe.objects.filter(
                 recipe=recipe,
-                ingredient=models.Ingredient.objects.get(pk=ingredient_id),
+                ingredient_id__in=removed
+            ).delete()
+        added = [
+            models.IngredientInRecipe(
+                recipe=recipe,
+                ingredient_id=ingredient_id,
                 amount=amount
             )
+            for ingredient_id, amount in new.items()
+            if ingredient_id not in current
+        ]
+        if added:
+            models.IngredientInRecipe.objects.bulk_create(added)
+        changed = []
+        # bulk_create и bulk_update без сигналов - суммы корзин сдвигаем сами,
+        # удаленные строки сдвигают сигналы post_delete
+        deltas = {
+            (recipe.pk, row.ingredient_id): row.amount or 0 for row in added
+        }
+        for ingredient_id, row in current.items():
+            if ingredient_id in new and row.amount != new[ingredient_id]:
+                deltas[(recipe.pk, ingredient_id)] = (
+                    new[ingredient_id] - (row.amount or 0)
+                )
+                row.amount = new[ingredient_id]
+                changed.append(row)
+        if changed:
+            models.IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        shopping_totals.recipes_changed(deltas)
 
     @transaction.atomic
     def create(self, validated_data):
@@ -176,6 +363,7 @@ class CreateRecipeSerializers(serializers.ModelSerializer):
         return recipe
 
     # экземпляр модели
+    @transaction.atomic
     def update(self, instance, validated_data):
         instance.image = validated_data.get('image', instance.image)
         instance.name = validated_data.get('name', instance.name)
@@ -184,24 +372,26 @@ class CreateRecipeSerializers(serializers.ModelSerializer):
             'cooking_time',
             instance.cooking_time
         )
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
-        models.IngredientInRecipe.objects.filter(
-            recipe=instance,
-            ingredient__in=instance.ingredients.all()
-        ).delete()
-        self.tags_and_ingredients_set(instance, tags, ingredients)
+        if 'tags' in validated_data:
+            self.update_tags(instance, validated_data.pop('tags'))
+        if 'ingredients' in validated_data:
+            self.update_ingredients(instance, validated_data.pop('ingredients'))
         instance.save()
         return instance
 
     def to_representation(self, instance):
+        # перечитываем рецепт со связями фиксированным числом запросов
+        request = self.context.get('request')
+        instance = models.Recipe.objects.with_related().with_user_flags(
+            request.user if request else None
+        ).get(pk=instance.pk)
         return ShowRecipeSerializer(
             instance,
             context=self.context
         ).data
 
 
-class FavoriteSerializers(serializers.ModelSerializer):
+class FavoriteSerializers(TimedSerializerMixin, serializers.ModelSerializer):
     recipe = serializers.PrimaryKeyRelatedField(
         queryset=models.Recipe.objects.all()
     )
@@ -230,3 +420,12 @@ class ShoppingCartSerializers(FavoriteSerializers):
             "recipe",
             "user"
         )
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для массового добавления и удаления"""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_LIMIT
+    )
@@ -0,0 +1,174 @@
+"""Суммы ингредиентов списков покупок, которые ведутся по мере изменений.
+
+Строка ShoppingListItem - сколько ингредиента нужно пользователю по всем
+рецептам его корзины. Сумма сдвигается в той же транзакции, что и запись,
+которая ее меняет: добавление или удаление рецепта из корзины (сигналы
+ShoppingCart и recipe_lists) и изменение ингредиентов рецепта, который
+лежит в чьей-то корзине (сигналы IngredientInRecipe и сериализатор
+рецепта). Поэтому выгрузка списка покупок читает готовые строки, а не
+собирает GROUP BY по всей корзине. Строки с суммой <= 0 не показываются
+и удаляются; расхождения с данными сверяет и чинит repair_shopping_lists.
+"""
+from collections import Counter
+
+from django.db import connection
+from django.db.models import Sum
+
+from . import models
+
+
+def table():
+    return connection.ops.quote_name(models.ShoppingListItem._meta.db_table)
+
+
+def upsert(select):
+    """INSERT ... SELECT (user_id, ingredient_id, amount), который
+    прибавляет amount к уже существующим строкам"""
+    # WHERE в select обязателен для INSERT ... SELECT ... ON CONFLICT в SQLite
+    return (
+        f"INSERT INTO {table()} (user_id, ingredient_id, amount) {select} "
+        "ON CONFLICT (user_id, ingredient_id) "
+        f"DO UPDATE SET amount = {table()}.amount + excluded.amount"
+    )
+
+
+def cart_statement(user_id, delta, recipes):
+    """Сдвиг сумм пользователя на ингредиенты рецептов из подзапроса
+    recipes; без параметров, чтобы войти в WITH recipe_lists"""
+    quote = connection.ops.quote_name
+    return upsert(
+        f"SELECT {int(user_id)}, ingredient_id, "
+        f"{int(delta)} * SUM(COALESCE(amount, 0)) "
+        f"FROM {quote(models.IngredientInRecipe._meta.db_table)} "
+        f"WHERE recipe_id IN ({recipes}) GROUP BY ingredient_id"
+    )
+
+
+def drop_empty(**lookups):
+    models.ShoppingListItem.objects.filter(amount__lte=0, **lookups).delete()
+
+
+def cart_changed(user_id, recipe_ids, delta):
+    """Рецепты recipe_ids добавлены в корзину (delta=1) или убраны (-1)"""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    placeholders = ", ".join(["%s"] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            cart_statement(user_id, delta, placeholders),
+            recipe_ids
+        )
+    if delta < 0:
+        drop_empty(user_id=user_id)
+
+
+def recipes_changed(deltas):
+    """deltas - {(recipe_id, ingredient_id): изменение количества};
+    сдвигает суммы всех, у кого рецепт в корзине"""
+    deltas = {key: value for key, value in deltas.items() if value}
+    if not deltas:
+        return
+    quote = connection.ops.quote_name
+    # UNION ALL вместо VALUES: SQLite не умеет имена столбцов у VALUES
+    changes = " UNION ALL ".join(
+        ["SELECT %s AS recipe_id, %s AS ingredient_id, %s AS amount"]
+        * len(deltas)
+    )
+    params = [
+        value for (recipe_id, ingredient_id), delta in deltas.items()
+        for value in (recipe_id, ingredient_id, delta)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            upsert(
+                "SELECT cart.user_id, changes.ingredient_id, "
+                "SUM(changes.amount) "
+                f"FROM {quote(models.ShoppingCart._meta.db_table)} cart "
+                f"JOIN ({changes}) changes "
+                "ON changes.recipe_id = cart.recipe_id "
+                "WHERE true GROUP BY cart.user_id, changes.ingredient_id"
+            ),
+            params
+        )
+    if any(delta < 0 for delta in deltas.values()):
+        drop_empty(ingredient_id__in={
+            ingredient_id for (_, ingredient_id), delta in deltas.items()
+            if delta < 0
+        })
+
+
+def actual_totals():
+    """{(user_id, ingredient_id): сумма}, посчитанные заново по корзинам"""
+    rows = models.IngredientInRecipe.objects.filter(
+        recipe__shopping_cart__isnull=False
+    ).values(
+        "recipe__shopping_cart__user_id",
+        "ingredient_id"
+    ).annotate(total=Sum("amount")).order_by()
+    return {
+        (row["recipe__shopping_cart__user_id"], row["ingredient_id"]):
+            row["total"]
+        for row in rows
+        if row["total"]
+    }
+
+
+def stored_totals():
+    # строки с суммой <= 0 выгрузка не показывает - их как будто нет
+    return {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in (
+            models.ShoppingListItem.objects.filter(amount__gt=0).values_list(
+                "user_id", "ingredient_id", "amount"
+            )
+        )
+    }
+
+
+def check():
+    """Ключи (user_id, ingredient_id), где сохраненная сумма неверна"""
+    actual = actual_totals()
+    stored = stored_totals()
+    return sorted(
+        key for key in actual.keys() | stored.keys()
+        if actual.get(key) != stored.get(key)
+    )
+
+
+def repair():
+    """Приводит суммы к данным корзин, возвращает число исправленных строк
+    по видам: лишние, неверные, недостающие"""
+    actual = actual_totals()
+    stored = stored_totals()
+    extra = [
+        pk for pk, user_id, ingredient_id in (
+            models.ShoppingListItem.objects.values_list(
+                "pk", "user_id", "ingredient_id"
+            )
+        )
+        if (user_id, ingredient_id) not in actual
+    ]
+    models.ShoppingListItem.objects.filter(pk__in=extra).delete()
+    fixed = Counter(extra=len(extra), wrong=0, missing=0)
+    rows = []
+    for key, amount in actual.items():
+        if key not in stored:
+            fixed["missing"] += 1
+        elif stored[key] != amount:
+            fixed["wrong"] += 1
+        else:
+            continue
+        rows.append(models.ShoppingListItem(
+            user_id=key[0],
+            ingredient_id=key[1],
+            amount=amount
+        ))
+    models.ShoppingListItem.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=["user", "ingredient"],
+        update_fields=["amount"]
+    )
+    return dict(fixed)
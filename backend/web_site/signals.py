@@ -0,0 +1,229 @@
+from collections import Counter
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from users.authentication import invalidate_user
+from users.models import Follow
+from . import counters, images, models, search, shopping_totals, versions
+from .ingredients_index import ingredients_index
+from .tag_slugs import tag_slugs
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=models.Ingredient)
+@receiver(post_delete, sender=models.Ingredient)
+def ingredients_changed(**kwargs):
+    # после коммита: иначе другой воркер соберет индекс из старых строк
+    # под новой версией и не пересоберет его до следующего изменения
+    transaction.on_commit(ingredients_index.invalidate)
+    versions.bump_version_on_commit(versions.RECIPES)
+
+
+@receiver(post_save, sender=models.Tag)
+@receiver(post_delete, sender=models.Tag)
+def tags_changed(**kwargs):
+    tag_slugs.invalidate()
+    versions.bump_version_on_commit(versions.TAGS, versions.RECIPES)
+
+
+@receiver(post_save, sender=models.Recipe)
+@receiver(post_delete, sender=models.Recipe)
+def recipe_changed(instance, **kwargs):
+    versions.bump_version_on_commit(
+        versions.RECIPES,
+        versions.recipe(instance.pk)
+    )
+
+
+@receiver(post_save, sender=models.Recipe)
+def recipe_image_changed(instance, **kwargs):
+    if images.needs_derivatives(instance):
+        transaction.on_commit(
+            partial(images.schedule_derivatives, instance.pk)
+        )
+
+
+# поисковые документы: название и описание рецепта, названия ингредиентов
+@receiver(post_save, sender=models.Recipe)
+def recipe_search_changed(instance, **kwargs):
+    search.schedule_update([instance.pk])
+
+
+@receiver(post_delete, sender=models.Recipe)
+def recipe_search_deleted(instance, **kwargs):
+    search.delete_documents([instance.pk])
+
+
+@receiver(post_save, sender=models.IngredientInRecipe)
+@receiver(post_delete, sender=models.IngredientInRecipe)
+def recipe_ingredients_search_changed(instance, **kwargs):
+    search.schedule_update([instance.recipe_id])
+
+
+@receiver(post_save, sender=models.Ingredient)
+def ingredient_search_changed(instance, created, **kwargs):
+    if created:
+        return
+    search.schedule_update(
+        models.IngredientInRecipe.objects.filter(
+            ingredient=instance
+        ).values_list("recipe_id", flat=True)
+    )
+
+
+@receiver(post_save, sender=models.IngredientInRecipe)
+@receiver(post_delete, sender=models.IngredientInRecipe)
+@receiver(post_save, sender=models.TagsInRecipe)
+@receiver(post_delete, sender=models.TagsInRecipe)
+def recipe_relations_changed(instance, **kwargs):
+    versions.bump_version_on_commit(
+        versions.RECIPES,
+        versions.recipe(instance.recipe_id)
+    )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(instance, update_fields=None, **kwargs):
+    # вход пользователя обновляет только last_login - это не изменение профиля
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    versions.bump_version_on_commit(
+        versions.USERS,
+        versions.RECIPES,
+        versions.profile(instance.pk)
+    )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_auth_changed(instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    auth_changed(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    auth_changed(instance.user_id)
+
+
+def auth_changed(user_id):
+    # сразу - чтобы другие процессы перестали доверять кэшу, и после
+    # коммита - чтобы не остался пользователь, прочитанный до коммита
+    invalidate_user(user_id)
+    transaction.on_commit(partial(invalidate_user, user_id))
+
+
+@receiver(post_save, sender=models.Favorite)
+@receiver(post_delete, sender=models.Favorite)
+@receiver(post_save, sender=models.ShoppingCart)
+@receiver(post_delete, sender=models.ShoppingCart)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def user_state_changed(instance, **kwargs):
+    versions.bump_version_on_commit(
+        versions.user_state(instance.user_id)
+    )
+
+
+# счетчики: сохранение этих моделей идет в транзакции (CountersMixin),
+# удаление - в транзакции Collector, поэтому F() попадает в ту же транзакцию
+@receiver(pre_save, sender=models.Recipe)
+@receiver(pre_save, sender=models.Favorite)
+@receiver(pre_save, sender=models.ShoppingCart)
+@receiver(pre_save, sender=Follow)
+def remember_counted(sender, instance, **kwargs):
+    # связь может смениться в админке - запоминаем, у кого отнять
+    if instance._state.adding:
+        return
+    instance._counted_before = sender.objects.filter(
+        pk=instance.pk
+    ).values(*(field for field, _, _ in counters.counted_by(sender))).first()
+
+
+@receiver(post_save, sender=models.Recipe)
+@receiver(post_save, sender=models.Favorite)
+@receiver(post_save, sender=models.ShoppingCart)
+@receiver(post_save, sender=Follow)
+def counted_saved(sender, instance, created, **kwargs):
+    before = None if created else getattr(instance, "_counted_before", None)
+    for field, target, counter in counters.counted_by(sender):
+        current = getattr(instance, field)
+        if created:
+            counters.add(target, counter, [current])
+        elif before and before[field] != current:
+            counters.add(target, counter, [before[field]], -1)
+            counters.add(target, counter, [current])
+
+
+@receiver(post_delete, sender=models.Recipe)
+@receiver(post_delete, sender=models.Favorite)
+@receiver(post_delete, sender=models.ShoppingCart)
+@receiver(post_delete, sender=Follow)
+def counted_deleted(sender, instance, **kwargs):
+    for field, target, counter in counters.counted_by(sender):
+        counters.add(target, counter, [getattr(instance, field)], -1)
+
+
+# суммы списков покупок: корзина и ингредиенты рецептов из корзин
+@receiver(pre_save, sender=models.ShoppingCart)
+@receiver(pre_save, sender=models.IngredientInRecipe)
+def remember_shopping_totals(sender, instance, **kwargs):
+    if instance._state.adding:
+        return
+    fields = (
+        ("user_id", "recipe_id") if sender is models.ShoppingCart
+        else ("recipe_id", "ingredient_id", "amount")
+    )
+    instance._totals_before = sender.objects.filter(
+        pk=instance.pk
+    ).values(*fields).first()
+
+
+@receiver(post_save, sender=models.ShoppingCart)
+def cart_totals_saved(instance, created, **kwargs):
+    before = None if created else getattr(instance, "_totals_before", None)
+    if before and before != {
+        "user_id": instance.user_id,
+        "recipe_id": instance.recipe_id
+    }:
+        shopping_totals.cart_changed(
+            before["user_id"],
+            [before["recipe_id"]],
+            -1
+        )
+    if created or before:
+        shopping_totals.cart_changed(instance.user_id, [instance.recipe_id], 1)
+
+
+@receiver(post_delete, sender=models.ShoppingCart)
+def cart_totals_deleted(instance, **kwargs):
+    shopping_totals.cart_changed(instance.user_id, [instance.recipe_id], -1)
+
+
+@receiver(post_save, sender=models.IngredientInRecipe)
+def recipe_ingredient_totals_saved(instance, created, **kwargs):
+    before = None if created else getattr(instance, "_totals_before", None)
+    deltas = Counter()
+    if before:
+        key = (before["recipe_id"], before["ingredient_id"])
+        deltas[key] -= before["amount"] or 0
+    if created or before:
+        key = (instance.recipe_id, instance.ingredient_id)
+        deltas[key] += instance.amount or 0
+    shopping_totals.recipes_changed(deltas)
+
+
+@receiver(post_delete, sender=models.IngredientInRecipe)
+def recipe_ingredient_totals_deleted(instance, **kwargs):
+    shopping_totals.recipes_changed({
+        (instance.recipe_id, instance.ingredient_id): -(instance.amount or 0)
+    })
@@ -0,0 +1,53 @@
+"""Соответствие slug -> id тегов в памяти процесса для фильтра ленты.
+
+Фильтр ?tags= приходит почти в каждом запросе ленты, а тегов единицы,
+поэтому каждый воркер держит их slug целиком и не ходит за ними в бд.
+Процессы сверяются с версией тегов в общем кэше (versions.py) не чаще
+CHECK_INTERVAL секунд; незнакомый slug заставляет сверку сразу, чтобы
+только что созданный тег находился без задержки.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from . import models, versions
+
+CHECK_INTERVAL = getattr(settings, "TAG_SLUGS_CHECK_INTERVAL", 5)
+
+
+class TagSlugs:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._version = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        """Сбрасывает соответствие этого процесса"""
+        self._version = None
+
+    def _ensure_fresh(self, force=False):
+        now = time.monotonic()
+        if (not force and self._version is not None
+                and now - self._checked_at < CHECK_INTERVAL):
+            return
+        with self._lock:
+            version = versions.get_version(versions.TAGS)
+            if self._version != version:
+                # словарь меняется одной ссылкой - читатели не ждут
+                self._ids = dict(models.Tag.objects.values_list("slug", "id"))
+                self._version = version
+            self._checked_at = now
+
+    def ids(self, slugs):
+        """id тегов по slug; незнакомые slug пропускаются"""
+        self._ensure_fresh()
+        if any(slug not in self._ids for slug in slugs):
+            self._ensure_fresh(force=True)
+        ids = self._ids
+        return sorted({ids[slug] for slug in slugs if slug in ids})
+
+
+tag_slugs = TagSlugs()
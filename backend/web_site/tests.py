@@ -0,0 +1,819 @@
+import base64
+import io
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from users.models import Follow, User
+from . import (
+    counters,
+    models,
+    popularity,
+    search,
+    shopping_totals,
+    versions
+)
+from .ingredients_index import ingredients_index
+from .pagination import RecipeCursorPagination
+from .recipe_lists import BULK_LIMIT
+
+
+def image_data():
+    buffer = io.BytesIO()
+    Image.new("RGB", (2, 2), "white").save(buffer, "PNG")
+    return (
+        "data:image/png;base64,"
+        + base64.b64encode(buffer.getvalue()).decode()
+    )
+
+
+@override_settings(MEDIA_ROOT="/tmp/foodgram-tests-media")
+class APITestCase(TestCase):
+    """Пользователь с токеном, теги, ингредиенты и рецепты для тестов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email="cook@example.com",
+            username="cook",
+            first_name="Имя",
+            last_name="Фамилия",
+            password="secret-password-1"
+        )
+        cls.tag = models.Tag.objects.create(
+            name="Завтрак", color="#E26C2D", slug="breakfast"
+        )
+        cls.ingredient = models.Ingredient.objects.create(
+            name="соль", measurement_unit="г"
+        )
+
+    def setUp(self):
+        caches["default"].clear()
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=(
+                f"Token {Token.objects.get_or_create(user=self.user)[0]}"
+            )
+        )
+
+    def create_recipe(self, name="Рецепт", amount=10, author=None):
+        recipe = models.Recipe.objects.create(
+            author=author or self.user,
+            name=name,
+            image="recipes/test.png",
+            text="Текст",
+            cooking_time=5
+        )
+        recipe.tags.add(self.tag)
+        models.IngredientInRecipe.objects.create(
+            recipe=recipe, ingredient=self.ingredient, amount=amount
+        )
+        return recipe
+
+
+class CreateRecipeTests(APITestCase):
+
+    def payload(self, **fields):
+        return {
+            "tags": [self.tag.id],
+            "ingredients": [{"id": self.ingredient.id, "amount": 10}],
+            "name": "Омлет",
+            "image": image_data(),
+            "text": "Взбить и пожарить",
+            "cooking_time": 10,
+            **fields
+        }
+
+    def test_create(self):
+        response = self.client.post(
+            "/api/recipes/", self.payload(), format="json"
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(
+            [tag["id"] for tag in response.data["tags"]], [self.tag.id]
+        )
+
+    def test_duplicate_tags_rejected(self):
+        response = self.client.post(
+            "/api/recipes/",
+            self.payload(tags=[self.tag.id, self.tag.id]),
+            format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.Recipe.objects.exists())
+
+
+class RecipeCursorPaginationTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        # у всех рецептов одна pub_date: порядок решает id
+        pub_date = timezone.now()
+        self.recipes = [self.create_recipe(f"Рецепт {i}") for i in range(5)]
+        models.Recipe.objects.update(pub_date=pub_date)
+
+    def test_encode_decode(self):
+        paginator = RecipeCursorPagination()
+        recipe = models.Recipe.objects.get(pk=self.recipes[0].pk)
+        self.assertEqual(
+            paginator.decode_cursor(paginator.encode_cursor(recipe)),
+            (recipe.pub_date, recipe.pk)
+        )
+
+    def test_pages_with_equal_pub_date(self):
+        ids = []
+        url = "/api/recipes/?cursor=&limit=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("count", response.data)
+            ids += [recipe["id"] for recipe in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(
+            ids, sorted((recipe.pk for recipe in self.recipes), reverse=True)
+        )
+
+    def test_malformed_cursor(self):
+        for cursor in ("not-base64!", "bm90LWEtY3Vyc29y"):
+            response = self.client.get(f"/api/recipes/?cursor={cursor}")
+            self.assertEqual(response.status_code, 404)
+
+    def test_limit_is_capped(self):
+        paginator = RecipeCursorPagination()
+        request = APIRequestFactory().get("/api/recipes/?cursor=&limit=1000")
+        self.assertEqual(
+            paginator.get_page_size(Request(request)),
+            paginator.max_page_size
+        )
+        self.assertEqual(paginator.max_page_size, 100)
+
+    def test_search_falls_back_to_page_numbers(self):
+        response = self.client.get("/api/recipes/?cursor=&search=Рецепт")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("count", response.data)
+
+
+class SearchTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lunch = models.Tag.objects.create(
+            name="Обед", color="#49B64E", slug="lunch"
+        )
+        self.other = User.objects.create_user(
+            email="author@example.com",
+            username="author",
+            first_name="Автор",
+            last_name="Автор",
+            password="secret-password-1"
+        )
+        tomato = models.Ingredient.objects.create(
+            name="томаты", measurement_unit="г"
+        )
+        # слово в названии, в ингредиентах и в описании
+        self.by_name = self.create_recipe("Томатный суп")
+        self.by_ingredient = self.create_recipe("Салат", author=self.other)
+        models.IngredientInRecipe.objects.create(
+            recipe=self.by_ingredient, ingredient=tomato, amount=100
+        )
+        self.by_text = self.create_recipe("Паста")
+        self.by_text.text = "Залить соусом из томатов"
+        self.by_text.save()
+        self.by_text.tags.set([self.lunch])
+        self.create_recipe("Омлет")
+        search.update_documents()
+
+    def ids(self, **params):
+        response = self.client.get(
+            "/api/recipes/", {"search": "томат", **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [recipe["id"] for recipe in response.data["results"]]
+
+    def test_ranking(self):
+        self.assertEqual(
+            self.ids(),
+            [self.by_name.pk, self.by_ingredient.pk, self.by_text.pk]
+        )
+
+    def test_with_filters(self):
+        self.assertEqual(self.ids(tags="lunch"), [self.by_text.pk])
+        self.assertEqual(
+            self.ids(author=self.other.pk), [self.by_ingredient.pk]
+        )
+        self.assertEqual(
+            self.ids(tags="breakfast", author=self.user.pk),
+            [self.by_name.pk]
+        )
+
+    def test_cursor_falls_back_to_page_numbers(self):
+        for number in range(5):
+            self.create_recipe(f"Томатный соус {number}")
+        search.update_documents()
+        expected = self.ids(page=1) + self.ids(page=2)
+        ids = []
+        response = self.client.get(
+            "/api/recipes/", {"cursor": "", "search": "томат"}
+        )
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["count"], 8)
+            ids += [recipe["id"] for recipe in response.data["results"]]
+            if not response.data["next"]:
+                break
+            response = self.client.get(response.data["next"])
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(set(ids)), 8)
+
+
+class RecipeQueryCountTests(APITestCase):
+    """Число запросов ленты не зависит от размера страницы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.tags = [cls.tag, models.Tag.objects.create(
+            name="Обед", color="#49B64E", slug="lunch"
+        )]
+        cls.ingredients = [cls.ingredient, *(
+            models.Ingredient.objects.create(name=name, measurement_unit="г")
+            for name in ("сахар", "мука")
+        )]
+
+    def add_recipes(self, count):
+        for number in range(count):
+            recipe = self.create_recipe(f"Рецепт {number}")
+            recipe.tags.set(self.tags)
+            for ingredient in self.ingredients[1:]:
+                models.IngredientInRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=number + 1
+                )
+
+    def page_queries(self, url, client):
+        # кэш фрагментов и ответов холодный: все рецепты собираются заново
+        caches["default"].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        for recipe in results:
+            self.assertEqual(len(recipe["tags"]), 2)
+            self.assertEqual(len(recipe["ingredients"]), 3)
+        return len(results), len(queries)
+
+    def test_list(self):
+        anonymous = APIClient()
+        for url, size in (
+            ("/api/recipes/?cursor=&limit=10", 10),
+            ("/api/recipes/", 6),
+        ):
+            for client in (self.client, anonymous):
+                with self.subTest(url, anonymous=client is anonymous):
+                    models.Recipe.objects.all().delete()
+                    self.add_recipes(1)
+                    single = self.page_queries(url, client)
+                    self.add_recipes(size - 1)
+                    full = self.page_queries(url, client)
+                    self.assertEqual((single[0], full[0]), (1, size))
+                    self.assertEqual(single[1], full[1])
+
+
+class IngredientsIndexTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for name in ("тростниковый сахар", "Сахар", "сахарная пудра",
+                     "Свёкла"):
+            models.Ingredient.objects.create(name=name, measurement_unit="г")
+
+    def setUp(self):
+        super().setUp()
+        # индекс общий для процесса и мог остаться от другого теста
+        ingredients_index.invalidate()
+
+    def names(self, query):
+        response = self.client.get("/api/ingredients/", {"name": query})
+        self.assertEqual(response.status_code, 200)
+        return [item["name"] for item in response.data]
+
+    def test_prefix_before_substring(self):
+        self.assertEqual(
+            self.names("сахар"),
+            ["Сахар", "сахарная пудра", "тростниковый сахар"]
+        )
+
+    def test_case_folding(self):
+        self.assertEqual(self.names("САХАРНАЯ"), ["сахарная пудра"])
+        self.assertEqual(self.names("сАхАр"), self.names("сахар"))
+
+    def test_yo_folding(self):
+        self.assertEqual(self.names("свекла"), ["Свёкла"])
+        self.assertEqual(self.names("СВЁК"), ["Свёкла"])
+
+    def test_rebuilt_after_create_and_rename(self):
+        self.assertEqual(self.names("ксилит"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = models.Ingredient.objects.create(
+                name="Сахарозаменитель", measurement_unit="г"
+            )
+        self.assertEqual(
+            self.names("сахар"),
+            ["Сахар", "сахарная пудра", "Сахарозаменитель",
+             "тростниковый сахар"]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.name = "Ксилит"
+            ingredient.save()
+        self.assertEqual(self.names("ксилит"), ["Ксилит"])
+        self.assertNotIn("Сахарозаменитель", self.names("сахар"))
+
+
+class RecipeListETagTests(APITestCase):
+
+    def test_not_modified_until_recipes_change(self):
+        self.create_recipe()
+        etag = self.client.get("/api/recipes/?limit=2&page=1")["ETag"]
+        # порядок параметров на ETag не влияет
+        response = self.client.get(
+            "/api/recipes/?page=1&limit=2", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+        self.create_recipe("Новый")
+        response = self.client.get(
+            "/api/recipes/?limit=2&page=1", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_validators_do_not_query_recipes(self):
+        self.create_recipe()
+        etag = self.client.get("/api/recipes/")["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                "/api/recipes/", HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any(
+            models.Recipe._meta.db_table in query["sql"]
+            for query in queries
+        ))
+
+
+class FragmentCacheTests(APITestCase):
+    """Закэшированный фрагмент рецепта собирается заново после изменений"""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe("Омлет")
+        self.urls = ("/api/recipes/", f"/api/recipes/{self.recipe.pk}/")
+
+    def responses(self):
+        data = []
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data.append(
+                response.data["results"][0]
+                if "results" in response.data else response.data
+            )
+        return data
+
+    def assertShown(self, check):
+        for recipe in self.responses():
+            check(recipe)
+
+    def test_served_from_cache(self):
+        self.responses()
+        # update() обходит сигналы: в ответе остается старый фрагмент
+        models.Recipe.objects.filter(pk=self.recipe.pk).update(name="Яичница")
+        self.assertShown(lambda recipe: self.assertEqual(
+            recipe["name"], "Омлет"
+        ))
+
+    def test_recipe_changed(self):
+        self.responses()
+        self.recipe.name = "Яичница"
+        self.recipe.save()
+        self.assertShown(lambda recipe: self.assertEqual(
+            recipe["name"], "Яичница"
+        ))
+
+    def test_author_changed(self):
+        self.responses()
+        self.user.first_name = "Повар"
+        self.user.username = "chef"
+        self.user.save()
+        self.assertShown(lambda recipe: self.assertEqual(
+            (recipe["author"]["first_name"], recipe["author"]["username"]),
+            ("Повар", "chef")
+        ))
+
+    def test_ingredients_changed(self):
+        pepper = models.Ingredient.objects.create(
+            name="перец", measurement_unit="г"
+        )
+        self.responses()
+        row = models.IngredientInRecipe.objects.get(recipe=self.recipe)
+        row.amount = 25
+        row.save()
+        self.assertShown(lambda recipe: self.assertEqual(
+            recipe["ingredients"][0]["amount"], 25
+        ))
+        # версию каталога ингредиентов меняет коммит
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ingredient.name = "морская соль"
+            self.ingredient.save()
+        self.assertShown(lambda recipe: self.assertEqual(
+            recipe["ingredients"][0]["name"], "морская соль"
+        ))
+        models.IngredientInRecipe.objects.create(
+            recipe=self.recipe, ingredient=pepper, amount=1
+        )
+        self.assertShown(lambda recipe: self.assertEqual(
+            len(recipe["ingredients"]), 2
+        ))
+
+
+class VersionsTests(TestCase):
+
+    def test_bump_again_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            versions.bump_version_on_commit("test")
+            self.assertGreater(versions.get_version("test"), 0)
+            # версию успел прочитать и запомнить другой процесс
+            caches["default"].set(versions.KEY_PREFIX + "test", 0)
+        self.assertGreater(versions.get_version("test"), 0)
+
+
+class ShoppingTotalsTests(APITestCase):
+
+    def test_remove_from_cart_leaves_no_drift(self):
+        recipe = self.create_recipe()
+        url = f"/api/recipes/{recipe.pk}/shopping_cart/"
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(
+            list(self.user.shopping_list.values_list("amount", flat=True)),
+            [10]
+        )
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(self.user.shopping_list.filter(amount__gt=0).exists())
+        self.assertEqual(shopping_totals.check(), [])
+
+    def test_empty_rows_are_not_drift(self):
+        # так остается строка после удаления из корзины одним запросом WITH
+        models.ShoppingListItem.objects.create(
+            user=self.user, ingredient=self.ingredient, amount=0
+        )
+        self.assertEqual(shopping_totals.check(), [])
+        shopping_totals.repair()
+        self.assertFalse(models.ShoppingListItem.objects.exists())
+
+
+class RecipeListTests(APITestCase):
+    lists = ("favorite", "shopping_cart")
+
+    def test_add_and_remove(self):
+        recipe = self.create_recipe()
+        for name in self.lists:
+            with self.subTest(name):
+                url = f"/api/recipes/{recipe.pk}/{name}/"
+                response = self.client.post(url)
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(
+                    response.data, {"recipe": recipe.pk, "user": self.user.pk}
+                )
+                self.assertEqual(self.client.post(url).status_code, 400)
+                self.assertEqual(self.client.delete(url).status_code, 204)
+                self.assertEqual(self.client.delete(url).status_code, 400)
+
+    def test_unknown_recipe(self):
+        for name in self.lists:
+            with self.subTest(name):
+                url = f"/api/recipes/999/{name}/"
+                response = self.client.post(url)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("recipe", response.data)
+                self.assertEqual(self.client.delete(url).status_code, 404)
+
+    def test_anonymous(self):
+        recipe = self.create_recipe()
+        self.client.credentials()
+        response = self.client.post(f"/api/recipes/{recipe.pk}/favorite/")
+        self.assertEqual(response.status_code, 401)
+
+    def test_bulk_outcomes(self):
+        first, second = self.create_recipe(), self.create_recipe("Второй")
+        for name in self.lists:
+            with self.subTest(name):
+                url = f"/api/recipes/{name}/bulk/"
+                self.client.post(url, {"recipes": [first.pk]}, format="json")
+                response = self.client.post(
+                    url,
+                    {"recipes": [first.pk, second.pk, 999, second.pk]},
+                    format="json"
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data["results"], [
+                    {"id": first.pk, "status": "already_added"},
+                    {"id": second.pk, "status": "added"},
+                    {"id": 999, "status": "not_found"},
+                ])
+                response = self.client.delete(
+                    url, {"recipes": [second.pk, 999]}, format="json"
+                )
+                self.assertEqual(response.data["results"], [
+                    {"id": second.pk, "status": "removed"},
+                    {"id": 999, "status": "not_found"},
+                ])
+                response = self.client.delete(
+                    url, {"recipes": [second.pk]}, format="json"
+                )
+                self.assertEqual(response.data["results"], [
+                    {"id": second.pk, "status": "not_added"},
+                ])
+
+    def test_bulk_limit(self):
+        for name in self.lists:
+            with self.subTest(name):
+                response = self.client.post(
+                    f"/api/recipes/{name}/bulk/",
+                    {"recipes": list(range(1, BULK_LIMIT + 2))},
+                    format="json"
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("recipes", response.data)
+                response = self.client.post(
+                    f"/api/recipes/{name}/bulk/",
+                    {"recipes": []},
+                    format="json"
+                )
+                self.assertEqual(response.status_code, 400)
+
+
+class RecipeCountersTests(APITestCase):
+
+    def assertCounts(self, recipe, favorites, shopping_cart):
+        recipe.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.shopping_cart_count),
+            (favorites, shopping_cart)
+        )
+        # пересчет с нуля не находит расхождений
+        self.assertFalse(any(counters.repair().values()))
+
+    def test_single_toggles(self):
+        recipe = self.create_recipe()
+        favorite = f"/api/recipes/{recipe.pk}/favorite/"
+        cart = f"/api/recipes/{recipe.pk}/shopping_cart/"
+        self.client.post(favorite)
+        self.assertCounts(recipe, 1, 0)
+        self.client.post(favorite)
+        self.assertCounts(recipe, 1, 0)
+        self.client.post(cart)
+        self.assertCounts(recipe, 1, 1)
+        self.client.delete(favorite)
+        self.assertCounts(recipe, 0, 1)
+        self.client.delete(favorite)
+        self.assertCounts(recipe, 0, 1)
+        self.client.delete(cart)
+        self.assertCounts(recipe, 0, 0)
+
+    def test_bulk_toggles(self):
+        first, second = self.create_recipe(), self.create_recipe("Второй")
+        url = "/api/recipes/favorite/bulk/"
+        self.client.post(url, {"recipes": [first.pk]}, format="json")
+        self.client.post(
+            url, {"recipes": [first.pk, second.pk, second.pk]}, format="json"
+        )
+        self.assertCounts(first, 1, 0)
+        self.assertCounts(second, 1, 0)
+        self.client.delete(url, {"recipes": [second.pk]}, format="json")
+        self.client.delete(
+            url, {"recipes": [first.pk, second.pk]}, format="json"
+        )
+        self.assertCounts(first, 0, 0)
+        self.assertCounts(second, 0, 0)
+
+    def test_other_users_count_too(self):
+        recipe = self.create_recipe()
+        other = User.objects.create_user(
+            email="guest@example.com",
+            username="guest",
+            first_name="Гость",
+            last_name="Гость",
+            password="secret-password-1"
+        )
+        models.Favorite.objects.create(user=other, recipe=recipe)
+        self.client.post(f"/api/recipes/{recipe.pk}/favorite/")
+        self.assertCounts(recipe, 2, 0)
+        models.Favorite.objects.filter(user=other).delete()
+        self.assertCounts(recipe, 1, 0)
+
+
+class ViewerFlagsTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(
+            email="author@example.com",
+            username="author",
+            first_name="Автор",
+            last_name="Автор",
+            password="secret-password-1"
+        )
+        Follow.objects.create(user=self.user, following=self.author)
+
+    def add_recipes(self, count):
+        for number in range(count):
+            recipe = self.create_recipe(f"Рецепт {number}", author=self.author)
+            models.Favorite.objects.create(user=self.user, recipe=recipe)
+            models.ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def feed_queries(self):
+        url = "/api/recipes/"
+        # первый запрос заполняет кэш фрагментов
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH="")
+        for recipe in response.data["results"]:
+            self.assertTrue(recipe["is_favorited"])
+            self.assertTrue(recipe["is_in_shopping_cart"])
+            self.assertTrue(recipe["author"]["is_subscribed"])
+        # по запросу на каждый вид флага, а не EXISTS на каждую строку
+        tables = [
+            f'FROM "{model._meta.db_table}" WHERE'
+            for model in (models.Favorite, models.ShoppingCart, Follow)
+        ]
+        self.assertEqual(
+            [
+                sum(table in query["sql"] for query in queries)
+                for table in tables
+            ],
+            [1, 1, 1]
+        )
+        return len(response.data["results"]), len(queries)
+
+    def test_flags_cost_does_not_grow_with_page(self):
+        self.add_recipes(1)
+        single = self.feed_queries()
+        self.add_recipes(5)
+        full = self.feed_queries()
+        self.assertEqual((single[0], full[0]), (1, 6))
+        self.assertEqual(single[1], full[1])
+
+
+class AnonymousCacheTests(APITestCase):
+
+    def test_hosts_are_cached_separately(self):
+        self.create_recipe()
+        self.client.credentials()
+        for host in ("localhost", "backend", "localhost"):
+            with self.subTest(host):
+                response = self.client.get(
+                    "/api/recipes/?limit=1", HTTP_HOST=host
+                )
+                self.assertEqual(response.status_code, 200)
+                data = response.json()
+                self.assertTrue(
+                    data["results"][0]["image"].startswith(f"http://{host}/")
+                )
+        self.assertEqual(response["X-Response-Cache"], "HIT")
+
+
+class PopularityTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.old, self.fresh, self.quiet = (
+            self.create_recipe(name) for name in ("Старый", "Свежий", "Тихий")
+        )
+        guest = User.objects.create_user(
+            email="guest@example.com",
+            username="guest",
+            first_name="Гость",
+            last_name="Гость",
+            password="secret-password-1"
+        )
+        # два события шесть дней назад против одного только что
+        for user in (self.user, guest):
+            models.Favorite.objects.create(user=user, recipe=self.old)
+        models.Favorite.objects.filter(recipe=self.old).update(
+            when_added=timezone.now() - timedelta(days=6)
+        )
+        models.ShoppingCart.objects.create(user=self.user, recipe=self.fresh)
+        popularity.refresh()
+
+    def ranking(self, window):
+        return list(models.RecipePopularity.objects.filter(
+            window=window
+        ).order_by("rank").values_list("recipe_id", "rank"))
+
+    def test_refresh_ranks_each_window(self):
+        # без затухания больше событий - выше место
+        self.assertEqual(
+            self.ranking("week"), [(self.old.pk, 1), (self.fresh.pk, 2)]
+        )
+        # с затуханием старые события почти ничего не весят
+        self.assertEqual(
+            self.ranking("trending"), [(self.fresh.pk, 1), (self.old.pk, 2)]
+        )
+
+    def test_ordering_popular(self):
+        ids = []
+        url = "/api/recipes/?ordering=popular&window=week&limit=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["count"], 3)
+            ids += [recipe["id"] for recipe in response.data["results"]]
+            url = response.data["next"]
+        # рецепт без места в рейтинге - после рейтинга, по дате
+        self.assertEqual(ids, [self.old.pk, self.fresh.pk, self.quiet.pk])
+        response = self.client.get("/api/recipes/?ordering=popular")
+        self.assertEqual(
+            [recipe["id"] for recipe in response.data["results"]],
+            [self.fresh.pk, self.old.pk, self.quiet.pk]
+        )
+
+    def test_unknown_window(self):
+        response = self.client.get("/api/recipes/?ordering=popular&window=x")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("window", response.data)
+
+
+class FillingDbTests(APITestCase):
+
+    def test_merges_duplicates_that_differ_by_whitespace(self):
+        spaced = models.Ingredient.objects.create(
+            name="перец", measurement_unit="г\n"
+        )
+        clean = models.Ingredient.objects.create(
+            name="перец", measurement_unit="г"
+        )
+        both = self.create_recipe("Оба")
+        models.IngredientInRecipe.objects.create(
+            recipe=both, ingredient=spaced, amount=2
+        )
+        models.IngredientInRecipe.objects.create(
+            recipe=both, ingredient=clean, amount=3
+        )
+        only_spaced = self.create_recipe("С пробелом")
+        models.IngredientInRecipe.objects.create(
+            recipe=only_spaced, ingredient=spaced, amount=4
+        )
+        models.ShoppingCart.objects.create(user=self.user, recipe=both)
+        with tempfile.NamedTemporaryFile(
+                "w", suffix=".csv", encoding="utf-8", delete=False
+        ) as file:
+            file.write("перец,г\n")
+        self.addCleanup(os.remove, file.name)
+
+        call_command("filling_db", file.name, stdout=io.StringIO())
+
+        self.assertEqual(
+            list(models.Ingredient.objects.filter(
+                name="перец"
+            ).values_list("pk", "measurement_unit")),
+            [(clean.pk, "г")]
+        )
+        self.assertEqual(
+            dict(models.IngredientInRecipe.objects.filter(
+                ingredient=clean
+            ).values_list("recipe_id", "amount")),
+            {both.pk: 5, only_spaced.pk: 4}
+        )
+        self.assertEqual(shopping_totals.check(), [])
+
+    def test_renamed_ingredients_update_search(self):
+        spaced = models.Ingredient.objects.create(
+            name=" укроп ", measurement_unit="г"
+        )
+        recipe = self.create_recipe()
+        models.IngredientInRecipe.objects.create(
+            recipe=recipe, ingredient=spaced, amount=1
+        )
+        with tempfile.NamedTemporaryFile(
+                "w", suffix=".csv", encoding="utf-8", delete=False
+        ) as file:
+            file.write("укроп,г\n")
+        self.addCleanup(os.remove, file.name)
+
+        with mock.patch.object(search, "update_documents") as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command("filling_db", file.name, stdout=io.StringIO())
+        spaced.refresh_from_db()
+        self.assertEqual(spaced.name, "укроп")
+        self.assertEqual(list(update.call_args.args[0]), [recipe.pk])
@@ -1,11 +1,14 @@
+from django.conf import settings
 from django.conf.urls import include
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from .views import (
+    FavoriteBulkView,
     FavoriteView,
     IngredientsView,
     RecipeView,
+    ShoppingCartBulkView,
     ShoppingCartViewSet,
     TagView,
     DownloadShoppingCartView
@@ -20,6 +23,16 @@ router.register(r"recipes", RecipeView, basename="recipes")
 urlpatterns = [
     path("recipes/<int:recipe_id>/favorite/", FavoriteView.as_view()),
     path("recipes/<int:recipe_id>/shopping_cart/", ShoppingCartViewSet.as_view()),
+    path("recipes/favorite/bulk/", FavoriteBulkView.as_view()),
+    path("recipes/shopping_cart/bulk/", ShoppingCartBulkView.as_view()),
     path("recipes/download_shopping_cart/", DownloadShoppingCartView.as_view(), name="download"),
     path("", include(router.urls)),
 ]
+
+if settings.ASYNC_READ_VIEWS:
+    from .async_views import get_urlpatterns
+
+    urlpatterns = get_urlpatterns(
+        router,
+        DownloadShoppingCartView.as_view()
+    ) + urlpatterns
@@ -0,0 +1,85 @@
+"""Версии данных в общем кэше.
+
+Версия - время последнего изменения группы данных. По ней процессы
+проверяют свежесть своих копий (индекс ингредиентов), а ответы API
+получают ETag и Last-Modified без рендеринга. Меняются версии
+сигналами из signals.py.
+"""
+import time
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+
+TAGS = "tags"
+INGREDIENTS = "ingredients"
+RECIPES = "recipes"
+USERS = "users"
+POPULARITY = "popularity"
+
+KEY_PREFIX = "web_site:version:"
+
+
+def recipe(recipe_id):
+    """Сам рецепт, его ингредиенты и теги"""
+    return f"recipe:{recipe_id}"
+
+
+def user_state(user_id):
+    """Избранное, корзина и подписки конкретного пользователя"""
+    return f"user:{user_id}"
+
+
+def profile(user_id):
+    """Имя, логин и почта пользователя - то, что видно у автора рецепта"""
+    return f"profile:{user_id}"
+
+
+def auth(user_id):
+    """Данные пользователя и его токен для кэша аутентификации"""
+    return f"auth:{user_id}"
+
+
+def get_versions(*names):
+    keys = {KEY_PREFIX + name: name for name in names}
+    versions = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in versions}
+    if missing:
+        # пропавшую из кэша версию считаем только что изменившейся
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return {keys[key]: value for key, value in versions.items()}
+
+
+def get_version(name):
+    return get_versions(name)[name]
+
+
+async def aget_versions(*names):
+    keys = {KEY_PREFIX + name: name for name in names}
+    versions = await cache.aget_many(keys)
+    missing = {key: time.time() for key in keys if key not in versions}
+    if missing:
+        await cache.aset_many(missing, timeout=None)
+        versions.update(missing)
+    return {keys[key]: value for key, value in versions.items()}
+
+
+async def aget_version(name):
+    return (await aget_versions(name))[name]
+
+
+def bump_version(*names):
+    now = time.time()
+    cache.set_many({KEY_PREFIX + name: now for name in names}, timeout=None)
+
+
+def bump_version_on_commit(*names):
+    """Меняет версии сразу и еще раз после коммита транзакции.
+
+    Сразу - чтобы кэши перестали отдавать старое, после коммита - чтобы
+    копия, прочитанная другим процессом до коммита, не осталась под
+    новой версией.
+    """
+    bump_version(*names)
+    transaction.on_commit(partial(bump_version, *names))
@@ -0,0 +1,82 @@
+"""Избранное, корзина и подписки пользователя запроса для флагов ответа.
+
+is_favorited, is_in_shopping_cart и is_subscribed синхронные view берут
+отсюда; аннотации (RecipeQuerySet.with_user_flags, подписки) остаются
+только там, где синхронный запрос делать нельзя. ViewerState живет в
+контексте сериализатора, то есть один на запрос, и хранит id в виде
+множеств. Списочные сериализаторы заранее
+сообщают id объектов страницы (expect), и при первом же флаге без
+аннотации они загружаются разом: не больше запроса на вид флага, сколько
+бы строк ни было на странице. Загрузка ленивая, поэтому асинхронные view,
+где флаги аннотированы, синхронных запросов отсюда не делают.
+"""
+from users.models import Follow
+from . import models
+
+
+class ViewerState:
+
+    def __init__(self, user):
+        self.user = user
+        self.favorites = set()
+        self.shopping_cart = set()
+        self.following = set()
+        # id, для которых множества уже загружены
+        self.recipes = set()
+        self.authors = set()
+        self.expected_recipes = set()
+        self.expected_authors = set()
+
+    def expect(self, recipe_ids=(), author_ids=()):
+        """id объектов, которые скоро понадобятся"""
+        self.expected_recipes.update(recipe_ids)
+        self.expected_authors.update(author_ids)
+
+    def load_recipes(self, recipe_id):
+        if recipe_id in self.recipes:
+            return
+        ids = (self.expected_recipes | {recipe_id}) - self.recipes
+        for model, found in (
+            (models.Favorite, self.favorites),
+            (models.ShoppingCart, self.shopping_cart),
+        ):
+            found.update(model.objects.filter(
+                user=self.user,
+                recipe_id__in=ids
+            ).values_list("recipe_id", flat=True))
+        self.recipes |= ids
+        self.expected_recipes.clear()
+
+    def load_authors(self, author_id):
+        if author_id in self.authors:
+            return
+        ids = (self.expected_authors | {author_id}) - self.authors
+        self.following.update(Follow.objects.filter(
+            user=self.user,
+            following_id__in=ids
+        ).values_list("following_id", flat=True))
+        self.authors |= ids
+        self.expected_authors.clear()
+
+    def is_favorited(self, recipe_id):
+        self.load_recipes(recipe_id)
+        return recipe_id in self.favorites
+
+    def is_in_shopping_cart(self, recipe_id):
+        self.load_recipes(recipe_id)
+        return recipe_id in self.shopping_cart
+
+    def is_subscribed(self, author_id):
+        self.load_authors(author_id)
+        return author_id in self.following
+
+
+def get(context):
+    """ViewerState из контекста сериализатора; None для анонима"""
+    request = context.get("request")
+    if request is None or request.user.is_anonymous:
+        return None
+    state = context.get("viewer_state")
+    if state is None or state.user.pk != request.user.pk:
+        state = context["viewer_state"] = ViewerState(request.user)
+    return state
@@ -1,34 +1,126 @@
-from django.db.models import Q
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+import csv
+import itertools
+from functools import partial
+
+from django.db.models import Exists, F, OuterRef
+from django.http import Http404, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import (
     viewsets,
     status
 )
-from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import (
     AllowAny,
+    IsAuthenticated,
     IsAuthenticatedOrReadOnly
 )
+from rest_framework.relations import PrimaryKeyRelatedField
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from . import (
+    popularity,
+    recipe_lists,
+    search,
     serializers,
-    models
+    models,
+    versions
+)
+from .ingredients_index import ingredients_index
+from .mixins import (
+    AnonymousCacheMixin,
+    ConditionalGetMixin,
+    normalized_params
 )
+from .pagination import RecipeCursorPagination
+from .tag_slugs import tag_slugs
+
+
+def filter_recipes(params, user, tag_ids=None):
+    """Рецепты по параметрам запроса, общие для sync и async view.
+
+    Связи проверяются через EXISTS, а не JOIN: строки рецептов не
+    размножаются, DISTINCT не нужен, и лента остается упорядоченной по
+    индексу pub_date. tag_ids - уже найденные id тегов из ?tags=
+    (асинхронный view ищет их сам).
+    """
+    queryset = models.Recipe.objects.all()
+
+    if user.is_authenticated:
+        for param, model in (
+            ("is_favorited", models.Favorite),
+            ("is_in_shopping_cart", models.ShoppingCart),
+        ):
+            if params.get(param) == "1":
+                queryset = queryset.filter(Exists(model.objects.filter(
+                    user=user,
+                    recipe=OuterRef("pk")
+                )))
+
+    author_id = params.get('author')
+    if author_id:
+        queryset = queryset.filter(author_id=author_id)
+
+    tags = params.getlist('tags')
+    if tags:
+        if tag_ids is None:
+            tag_ids = tag_slugs.ids(tags)
+        if not tag_ids:
+            return queryset.none()
+        queryset = queryset.filter(Exists(models.TagsInRecipe.objects.filter(
+            recipe=OuterRef("pk"),
+            tag_id__in=tag_ids
+        )))
 
+    # полнотекстовый поиск сортирует выдачу по релевантности
+    query = params.get('search', '').strip()
+    if query:
+        queryset = search.search(queryset, query)
+    return queryset
 
-class TagView(viewsets.ModelViewSet):
+
+def uses_cursor(request):
+    """Keyset-пагинация идет по pub_date, поэтому выдача поиска и рейтинг,
+    у которых свой порядок, листаются по номерам страниц и с ?cursor="""
+    params = request.query_params
+    return (
+        RecipeCursorPagination.requested(request)
+        and not search.requested(params)
+        and not popularity.requested(params)
+    )
+
+
+def list_validators(params, current):
+    """Валидаторы ленты: версии данных и параметры запроса.
+
+    Любое изменение рецептов, тегов, авторов и рейтинга меняет версии,
+    поэтому запросов к бд для ETag не нужно, и на попаданиях в кэш
+    ответов он ничего не стоит.
+    """
+    return (normalized_params(params), sorted(current.items())), None
+
+
+class TagView(ConditionalGetMixin, AnonymousCacheMixin,
+              viewsets.ModelViewSet):
     queryset = models.Tag.objects.all()
     serializer_class = serializers.TagSerializers
     permission_classes = [AllowAny, ]
     pagination_class = None
 
+    def get_cache_versions(self):
+        return (versions.TAGS,)
+
+    def get_list_validators(self):
+        version = versions.get_version(versions.TAGS)
+        return (version,), version
+
+    get_detail_validators = get_list_validators
+
 
-class IngredientsView(viewsets.ModelViewSet):
+class IngredientsView(ConditionalGetMixin, AnonymousCacheMixin,
+                      viewsets.ModelViewSet):
     queryset = models.Ingredient.objects.all()
     permission_classes = [IsAuthenticatedOrReadOnly, ]
     serializer_class = serializers.IngredientSerializer
@@ -38,47 +130,105 @@ class IngredientsView(viewsets.ModelViewSet):
 
     # метод, который выводит ингредиенты по первым буквам
     def get_queryset(self):
-        name = str(self.request.query_params.get("name"))
+        name = self.request.query_params.get("name")
         queryset = self.queryset
         if not name:
             return queryset
         start_queryset = queryset.filter(name__istartswith=name)
         return start_queryset
 
+    def get_list_validators(self):
+        version = versions.get_version(versions.INGREDIENTS)
+        return (version,), version
 
-class RecipeView(viewsets.ModelViewSet):
+    get_detail_validators = get_list_validators
+
+    def get_cache_versions(self):
+        return (versions.INGREDIENTS,)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_list_validators(),
+            partial(self.cached_response, self.search),
+            request, *args, **kwargs
+        )
+
+    # список отдается из индекса в памяти, без запросов к бд
+    def search(self, request, *args, **kwargs):
+        name = request.query_params.get("name")
+        if not name:
+            return Response(ingredients_index.all())
+        return Response(ingredients_index.search(name))
+
+
+class RecipeView(ConditionalGetMixin, AnonymousCacheMixin,
+                 viewsets.ModelViewSet):
     queryset = models.Recipe.objects.all()
     pagination_class = PageNumberPagination
     permissions = [IsAuthenticatedOrReadOnly, ]
     filter_backends = [DjangoFilterBackend, ]
+    conditional_per_user = True
 
+    # ?cursor= включает keyset-пагинацию вместо номеров страниц
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            if uses_cursor(self.request):
+                self._paginator = RecipeCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    # связи загружает ShowRecipeSerializer и только для рецептов,
+    # которых нет в кэше фрагментов, а флаги пользователя - viewer_state
+    # разом для всей страницы
     def get_queryset(self):
-        is_favorited = self.request.query_params.get('is_favorited')
-        is_in_shopping_cart = self.request.query_params.get('is_in_shopping_cart')
-        user = self.request.user
-        tags = self.request.query_params.getlist('tags')
-        author_id = self.request.query_params.get('author')
-        queryset = models.Recipe.objects.all()
-
-        if is_favorited and is_favorited == "1":
-            if user.is_authenticated:
-                queryset = models.Recipe.objects.filter(favorite__user=user)
-
-        if is_in_shopping_cart and is_in_shopping_cart == "1":
-            if user.is_authenticated:
-                queryset = queryset.filter(shopping_cart__user=user)
-
-        if author_id:
-            queryset = queryset.filter(author_id=author_id)
-
-        # Фильтруем рецепты по выбранным тегам
-        if tags:
-            #  это специальное выражение для фильтрации через связанные поля
-            tag_filter = Q(tags__slug__in=tags)
-            # distinct() для получения уникальных записей
-            queryset = queryset.filter(tag_filter).distinct()
+        return self.get_filtered_queryset()
+
+    def get_filtered_queryset(self):
+        return filter_recipes(self.request.query_params, self.request.user)
+
+    # ?ordering=popular - по готовому рейтингу, и при поиске тоже
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if (self.action == "list"
+                and popularity.requested(self.request.query_params)):
+            return popularity.ranked(queryset, self.request.query_params)
         return queryset
 
+    def get_cache_versions(self):
+        if self.action == "retrieve":
+            recipes = versions.recipe(self.kwargs.get("pk"))
+        else:
+            recipes = versions.RECIPES
+        names = (recipes, versions.TAGS, versions.INGREDIENTS, versions.USERS)
+        if (self.action != "retrieve"
+                and popularity.requested(self.request.query_params)):
+            names += (versions.POPULARITY,)
+        return names
+
+    def get_list_validators(self):
+        return list_validators(
+            self.request.query_params,
+            versions.get_versions(*self.get_cache_versions())
+        )
+
+    # валидаторы рецепта: его pub_date и версия его ингредиентов и тегов
+    def get_detail_validators(self):
+        pk = self.kwargs.get("pk")
+        pub_date = models.Recipe.objects.filter(pk=pk).values_list(
+            "pub_date",
+            flat=True
+        ).first() if str(pk).isdigit() else None
+        if pub_date is None:
+            return None
+        current = versions.get_versions(*self.get_cache_versions())
+        return (
+            pk,
+            pub_date.isoformat(),
+            sorted(current.items())
+        ), max(pub_date.timestamp(), *current.values())
+
     def get_serializer_class(self):
         method = self.request.method
         if method == "POST" or method == "PATCH":
@@ -88,111 +238,176 @@ class RecipeView(viewsets.ModelViewSet):
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context.update({"request": self.request})
+        if self.action != "list":
+            context["image_size"] = "full"
         return context
 
 
-class FavoriteView(APIView):
+class RecipeListView(APIView):
+    """Добавление (POST) и удаление (DELETE) одного рецепта из списка.
+
+    Каждое действие - один INSERT ... ON CONFLICT или DELETE ... RETURNING
+    (recipe_lists.py), поэтому двойное нажатие дает 400, а не
+    IntegrityError. Рецепт ищется, только если строка не изменилась.
+    """
     permission_classes = [IsAuthenticatedOrReadOnly, ]
+    model = None
+    serializer_class = None
+    already_added = None
 
-    @action(methods=["post", ], detail=True, )
     def post(self, request, recipe_id):
         user = request.user
-        data = {"user": user.id, "recipe": recipe_id, }
-        """Проверка, состоит ли объект модели в избранном для данного user и рецепта"""
-        if models.Favorite.objects.filter(
-                user=user,
-                recipe_id=recipe_id
-        ).exists():
-            return Response(
-                {"Ошибка": "Вы уже добавили в избранное"},
-                status=status.HTTP_400_BAD_REQUEST
+        if recipe_lists.add(self.model, user.id, [recipe_id]):
+            # строка не перечитывается: у сериализатора только id связей
+            serializer = self.serializer_class(
+                self.model(user_id=user.id, recipe_id=recipe_id)
             )
-        serializer = serializers.FavoriteSerializers(
-            data=data,
-            context={"request": request}
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        if not recipe_lists.existing([recipe_id]):
+            # та же ошибка, что раньше давала валидация сериализатора
+            message = PrimaryKeyRelatedField.default_error_messages[
+                "does_not_exist"
+            ]
+            raise ValidationError(
+                {"recipe": [message.format(pk_value=recipe_id)]}
+            )
+        return Response(
+            {"Ошибка": self.already_added},
+            status=status.HTTP_400_BAD_REQUEST
         )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    @action(methods=["DELETE", ], detail=True, )
     def delete(self, request, recipe_id):
-        user = request.user
-        recipe = get_object_or_404(models.Recipe, id=recipe_id)
-        if not models.Favorite.objects.filter(
-                user=user,
-                recipe=recipe
-        ).exists():
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-        models.Favorite.objects.get(user=user, recipe=recipe).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        if recipe_lists.remove(self.model, request.user.id, [recipe_id]):
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        if not recipe_lists.existing([recipe_id]):
+            raise Http404
+        return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-class ShoppingCartViewSet(APIView):
-    permission_classes = [IsAuthenticatedOrReadOnly, ]
+class FavoriteView(RecipeListView):
+    model = models.Favorite
+    serializer_class = serializers.FavoriteSerializers
+    already_added = "Вы уже добавили в избранное"
+
+
+class ShoppingCartViewSet(RecipeListView):
     pagination_class = None
+    model = models.ShoppingCart
+    serializer_class = serializers.ShoppingCartSerializers
+    already_added = "Вы уже добавили в корзину"
 
-    @action(methods=["post", ], detail=True)
-    def post(self, request, recipe_id):
-        user = request.user
-        data = {"user": user.id, "recipe": recipe_id, }
-        if models.ShoppingCart.objects.filter(
-                user=user,
-                recipe_id=recipe_id
-        ).exists():
-            return Response(
-                {"Ошибка": "Вы уже добавили в корзину"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        # создание экземпляра
-        serializer = serializers.ShoppingCartSerializers(
-            data=data,
-            context={"request": request}
-        )
+
+class RecipeListBulkView(APIView):
+    """Массовое добавление (POST) и удаление (DELETE) рецептов из списка
+    пользователя; в ответе - результат для каждого id"""
+    permission_classes = (IsAuthenticated,)
+    model = None
+
+    def get_recipe_ids(self, request):
+        serializer = serializers.RecipeIdsSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return list(dict.fromkeys(serializer.validated_data["recipes"]))
 
-    @action(methods=["DELETE", ], detail=True)
-    def delete(self, request, recipe_id):
-        user = request.user
-        recipe = get_object_or_404(models.Recipe, id=recipe_id)
-        if not models.ShoppingCart.objects.filter(
-                user=user,
-                recipe=recipe
-        ).exists():
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-        models.ShoppingCart.objects.get(user=user, recipe=recipe).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+    def outcomes(self, recipe_ids, changed, done, unchanged):
+        changed = set(changed)
+        rest = [pk for pk in recipe_ids if pk not in changed]
+        existing = recipe_lists.existing(rest) if rest else set()
+        results = []
+        for pk in recipe_ids:
+            if pk in changed:
+                outcome = done
+            elif pk in existing:
+                outcome = unchanged
+            else:
+                outcome = "not_found"
+            results.append({"id": pk, "status": outcome})
+        return Response({"results": results})
+
+    def post(self, request):
+        recipe_ids = self.get_recipe_ids(request)
+        added = recipe_lists.add(self.model, request.user.id, recipe_ids)
+        return self.outcomes(recipe_ids, added, "added", "already_added")
+
+    def delete(self, request):
+        recipe_ids = self.get_recipe_ids(request)
+        removed = recipe_lists.remove(self.model, request.user.id, recipe_ids)
+        return self.outcomes(recipe_ids, removed, "removed", "not_added")
+
+
+class FavoriteBulkView(RecipeListBulkView):
+    model = models.Favorite
+
+
+class ShoppingCartBulkView(RecipeListBulkView):
+    model = models.ShoppingCart
+
+
+class Echo:
+    """Буфер для csv.writer, который просто отдает записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def shopping_list(user):
+    # суммы уже посчитаны при изменении корзины (shopping_totals)
+    return models.ShoppingListItem.objects.filter(
+        user=user,
+        amount__gt=0
+    ).values(
+        "ingredient__name",
+        "ingredient__measurement_unit",
+        total_amount=F("amount")
+    ).order_by("ingredient__name")
+
+
+class ShoppingListFormat:
+    """Строки и заголовки файла списка покупок: txt или csv"""
+
+    def __init__(self, file_format):
+        self.is_csv = file_format == "csv"
+        self.writer = csv.writer(Echo())
+
+    def header(self):
+        if self.is_csv:
+            return [self.writer.writerow(
+                ("name", "measurement_unit", "amount")
+            )]
+        return []
+
+    def line(self, row):
+        # строки - словари values(): aiterator() в Django 4.2 не работает
+        # с values_list() без потока
+        name = row["ingredient__name"]
+        unit = row["ingredient__measurement_unit"]
+        amount = row["total_amount"]
+        if self.is_csv:
+            return self.writer.writerow((name, unit, amount))
+        return f"{name} - {amount} {unit}\n"
+
+    def response(self, lines):
+        if self.is_csv:
+            content_type = "text/csv; charset=utf-8"
+            filename = "shopping_list.csv"
+        else:
+            content_type = "text/plain; charset=utf-8"
+            filename = "shopping_list.txt"
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        response["Content-Disposition"] = (
+            f'attachment; filename="{filename}"'
+        )
+        return response
 
 
 class DownloadShoppingCartView(APIView):
+    permission_classes = [IsAuthenticated, ]
 
     def get(self, request):
-        user = request.user
-        shopping_cart = user.shopping_cart.all()
-        buying_list = {}
-        for record in shopping_cart:
-            # для каждой записи получает связанный с ней рецепт
-            recipe = record.recipe
-            ingredients = models.IngredientInRecipe.objects.filter(recipe=recipe)
-            for ingredient in ingredients:
-                amount = ingredient.amount
-                name = ingredient.ingredient.name
-                measurement_unit = ingredient.ingredient.measurement_unit
-                if name not in buying_list:
-                    buying_list[name] = {
-                        "measurement_unit": measurement_unit,
-                        "amount": amount,
-                    }
-                else:
-                    buying_list[name]["amount"] = (
-                            buying_list[name]["amount"] + amount
-                    )
-        wishlist = []
-        for name, data in buying_list.items():
-            wishlist.append(
-                f"{name} - {data['amount']} {data['measurement_unit']}"
-            )
-        response = HttpResponse(wishlist, content_type="text/plain")
-        return response
+        file_format = ShoppingListFormat(
+            request.query_params.get("file_format")
+        )
+        rows = shopping_list(request.user).iterator()
+        return file_format.response(itertools.chain(
+            file_format.header(),
+            (file_format.line(row) for row in rows)
+        ))